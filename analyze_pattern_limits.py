@@ -3,242 +3,311 @@
 Analyse des limites de patterns pour justifier les choix Top 5, Top 3, etc.
 """
 
-import json
-from collections import Counter
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from heapq import nlargest
+from operator import itemgetter
 from pathlib import Path
+import ahocorasick
 import numpy as np
+import orjson
 
-def analyze_pattern_statistics():
-    """Analyse les statistiques de patterns pour justifier les limites"""
-    print("=== ANALYSE DES STATISTIQUES DE PATTERNS ===")
+from src.config import MAX_PARALLEL_WORKERS
+from src.utils import list_enriched_files
+
+# Mots-clés contextuels analysés
+CONTEXT_KEYWORDS = [
+    'context', 'depending on', 'caller', 'usage', 'safe when', 
+    'unsafe if', 'condition', 'parameter', 'input validation', 
+    'caller responsibility', 'proper usage', 'misuse', 'when used',
+    'depends on', 'based on', 'according to'
+]
+
+# Mots-clés des patterns de correction (ordre significatif : premier match)
+FIX_KEYWORDS = {
+    'bounds_check_added': ['bound', 'check', 'length', 'size', 'overflow'],
+    'synchronization_added': ['lock', 'mutex', 'sync', 'atomic', 'race'],
+    'memory_management': ['free', 'malloc', 'memory', 'leak', 'allocation'],
+    'input_validation': ['validate', 'sanitize', 'input', 'check'],
+    'initialization': ['initialize', 'null', 'zero']
+}
+
+def _build_automaton(keyword_groups):
+    """Construit un automate Aho-Corasick : mot-clé -> (mot-clé, groupes)"""
+    groups_by_keyword = {}
+    for group, keywords in keyword_groups.items():
+        for keyword in keywords:
+            groups_by_keyword.setdefault(keyword.lower(), []).append(group)
     
-    ast_stats = {'fonctions': [], 'appels': [], 'variables': []}
-    pdg_stats = {'dépendances': [], 'variables': [], 'patterns': []}
+    automaton = ahocorasick.Automaton()
+    for keyword, groups in groups_by_keyword.items():
+        automaton.add_word(keyword, (keyword, tuple(groups)))
+    automaton.make_automaton()
+    return automaton
+
+# Automates construits une seule fois (un seul passage linéaire par texte)
+CONTEXT_AUTOMATON = _build_automaton({'context': CONTEXT_KEYWORDS})
+FIX_AUTOMATON = _build_automaton(FIX_KEYWORDS)
+
+def _update_ast_pdg_stats(item, ast_stats, pdg_stats, function_counts):
+    """Met à jour les statistiques AST/PDG pour une instance"""
+    structural = item.get('structural_analysis', {})
+    ast = structural.get('ast_patterns') or {}
+    pdg = structural.get('pdg_patterns') or {}
+    
+    # Patterns AST
+    if ast.get('success'):
+        patterns = ast.get('patterns', {})
+        
+        # Fonctions
+        functions = patterns.get('functions')
+        if functions is not None:
+            function_count = len(functions)
+            ast_stats['fonctions'].append(function_count)
+            metadata = item['_metadata']
+            function_counts.append({
+                'cve': metadata['cve_id'],
+                'cwe': metadata['cwe_id'],
+                'count': function_count
+            })
+        
+        # Appels
+        calls = patterns.get('calls')
+        if calls is not None:
+            ast_stats['appels'].append(len(calls))
+        
+        # Variables
+        variables = patterns.get('variables')
+        if variables is not None:
+            ast_stats['variables'].append(len(variables))
+    
+    # Patterns PDG
+    if pdg.get('success'):
+        # Dépendances
+        dependencies = pdg.get('dependencies')
+        if dependencies is not None:
+            pdg_stats['dépendances'].append(len(dependencies))
+        
+        # Variables
+        variables = pdg.get('variables')
+        if variables is not None:
+            pdg_stats['variables'].append(len(variables))
+        
+        # Patterns
+        patterns = pdg.get('patterns')
+        if patterns is not None:
+            pdg_stats['patterns'].append(len(patterns))
+
+def _update_keyword_stats(item, keyword_stats):
+    """Met à jour la fréquence des mots-clés contextuels pour une instance"""
+    vulrag = item.get('original_vulrag', {})
     
-    # Charger toutes les données
-    data_dir = Path("data/enriched")
-    for file_path in data_dir.glob("hybrid_kb_CWE-*.json"):
-        print(f"Analyse de {file_path.name}...")
-        with open(file_path, 'r') as f:
-            data = json.load(f)
+    semantic_text = "".join(
+        vulrag[field] for field in
+        ('GPT_analysis', 'specific_code_behavior_causing_vulnerability', 'solution')
+        if field in vulrag
+    ).lower()
+    
+    found = {keyword for _, (keyword, _groups) in CONTEXT_AUTOMATON.iter(semantic_text)}
+    for keyword in found:
+        keyword_stats[keyword] += 1
+
+def _update_fix_stats(item, pattern_stats):
+    """Met à jour la répartition des patterns de correction pour une instance"""
+    solution = item.get('original_vulrag', {}).get('solution')
+    
+    if solution is not None:
+        # Le premier groupe (dans l'ordre de FIX_KEYWORDS) présent l'emporte
+        seen_groups = set()
+        for _, (_keyword, groups) in FIX_AUTOMATON.iter(solution.lower()):
+            seen_groups.update(groups)
+        
+        for pattern in FIX_KEYWORDS:
+            if pattern in seen_groups:
+                pattern_stats[pattern] += 1
+                break
+        else:
+            pattern_stats['custom'] += 1
+    else:
+        pattern_stats['custom'] += 1
+
+def _new_statistics():
+    """Crée des accumulateurs vides"""
+    return {
+        # Tableaux d'entiers compacts (convertis en NumPy sans boxing)
+        'ast_stats': {'fonctions': array('i'), 'appels': array('i'), 'variables': array('i')},
+        'pdg_stats': {'dépendances': array('i'), 'variables': array('i'), 'patterns': array('i')},
+        'function_counts': [],
+        'keyword_stats': {keyword: 0 for keyword in CONTEXT_KEYWORDS},
+        'pattern_stats': {**{pattern: 0 for pattern in FIX_KEYWORDS}, 'custom': 0},
+        'total_instances': 0
+    }
+
+def _process_file(file_path):
+    """Analyse un fichier et renvoie ses statistiques partielles (exécuté dans un worker)"""
+    stats = _new_statistics()
+    try:
+        with open(file_path, 'rb') as f:
+            # JSONL : un enregistrement par ligne, lu au fil de l'eau
+            if file_path.suffix == '.jsonl':
+                data = (orjson.loads(line) for line in f if line.strip())
+            else:
+                data = orjson.loads(f.read())
             
             for item in data:
-                # Patterns AST
-                if item['structural_analysis']['ast_patterns'].get('success'):
-                    ast = item['structural_analysis']['ast_patterns']
-                    if 'patterns' in ast:
-                        patterns = ast['patterns']
-                        
-                        # Fonctions
-                        if 'functions' in patterns:
-                            ast_stats['fonctions'].append(len(patterns['functions']))
-                        
-                        # Appels
-                        if 'calls' in patterns:
-                            ast_stats['appels'].append(len(patterns['calls']))
-                        
-                        # Variables
-                        if 'variables' in patterns:
-                            ast_stats['variables'].append(len(patterns['variables']))
-                
-                # Patterns PDG
-                if item['structural_analysis']['pdg_patterns'].get('success'):
-                    pdg = item['structural_analysis']['pdg_patterns']
-                    
-                    # Dépendances
-                    if 'dependencies' in pdg:
-                        pdg_stats['dépendances'].append(len(pdg['dependencies']))
-                    
-                    # Variables
-                    if 'variables' in pdg:
-                        pdg_stats['variables'].append(len(pdg['variables']))
-                    
-                    # Patterns
-                    if 'patterns' in pdg:
-                        pdg_stats['patterns'].append(len(pdg['patterns']))
+                stats['total_instances'] += 1
+                _update_ast_pdg_stats(item, stats['ast_stats'], stats['pdg_stats'], stats['function_counts'])
+                _update_keyword_stats(item, stats['keyword_stats'])
+                _update_fix_stats(item, stats['pattern_stats'])
+    except Exception as e:
+        # Fichier illisible, partiel ou enregistrement malformé : le fichier est
+        # ignoré (et signalé) sans interrompre l'analyse des autres
+        return {'error': f"{type(e).__name__}: {e}"}
+    
+    return stats
+
+def _merge_statistics(total, partial):
+    """Fusionne des statistiques partielles dans les accumulateurs globaux"""
+    for group in ('ast_stats', 'pdg_stats'):
+        for pattern_type, values in partial[group].items():
+            total[group][pattern_type].extend(values)
+    for group in ('keyword_stats', 'pattern_stats'):
+        for key, count in partial[group].items():
+            total[group][key] += count
+    total['function_counts'].extend(partial['function_counts'])
+    total['total_instances'] += partial['total_instances']
+
+def collect_statistics(files):
+    """Analyse chaque fichier une seule fois, en parallèle, et agrège les résultats"""
+    stats = _new_statistics()
+    
+    # Les fichiers sont indépendants : un processus par fichier
+    with ProcessPoolExecutor(max_workers=MAX_PARALLEL_WORKERS) as executor:
+        for file_path, partial in zip(files, executor.map(_process_file, files)):
+            print(f"Analyse de {file_path.name}...")
+            if 'error' in partial:
+                print(f"  ❌ Fichier ignoré : {partial['error']}")
+                continue
+            _merge_statistics(stats, partial)
+    
+    return stats
+
+def _positive_array(values):
+    """Convertit une seule fois les valeurs > 0 en tableau NumPy int32"""
+    return np.fromiter(filter(None, values), dtype=np.int32)
+
+def analyze_pattern_statistics(ast_stats, pdg_stats, function_counts):
+    """Analyse les statistiques de patterns pour justifier les limites"""
+    print("=== ANALYSE DES STATISTIQUES DE PATTERNS ===")
     
     print(f"\n📊 STATISTIQUES DES PATTERNS AST :")
     for pattern_type, values in ast_stats.items():
-        if values:
-            values = [v for v in values if v > 0]  # Ne garder que les valeurs > 0
-            if values:
-                print(f"\n{pattern_type.upper()} :")
-                print(f"  Nombre d'instances avec {pattern_type} : {len(values)}")
-                print(f"  Moyenne : {np.mean(values):.1f}")
-                print(f"  Médiane : {np.median(values):.1f}")
-                print(f"  Maximum : {max(values)}")
-                print(f"  75e percentile : {np.percentile(values, 75):.1f}")
-                print(f"  90e percentile : {np.percentile(values, 90):.1f}")
-                print(f"  95e percentile : {np.percentile(values, 95):.1f}")
-                
-                # Distribution
-                print(f"  Distribution :")
-                for i in range(1, 11):
-                    count = sum(1 for v in values if v == i)
-                    if count > 0:
-                        print(f"    {i} : {count} instances ({count/len(values)*100:.1f}%)")
+        arr = _positive_array(values)  # Ne garder que les valeurs > 0
+        if arr.size:
+            p75, p90, p95 = np.percentile(arr, [75, 90, 95])
+            print(f"\n{pattern_type.upper()} :")
+            print(f"  Nombre d'instances avec {pattern_type} : {arr.size}")
+            print(f"  Moyenne : {arr.mean():.1f}")
+            print(f"  Médiane : {np.median(arr):.1f}")
+            print(f"  Maximum : {arr.max()}")
+            print(f"  75e percentile : {p75:.1f}")
+            print(f"  90e percentile : {p90:.1f}")
+            print(f"  95e percentile : {p95:.1f}")
+            
+            # Distribution
+            print(f"  Distribution :")
+            counts = np.bincount(arr, minlength=11)[1:11]
+            for i, count in enumerate(counts, start=1):
+                if count > 0:
+                    print(f"    {i} : {count} instances ({count/arr.size*100:.1f}%)")
     
     print(f"\n📊 STATISTIQUES DES PATTERNS PDG :")
     for pattern_type, values in pdg_stats.items():
-        if values:
-            values = [v for v in values if v > 0]  # Ne garder que les valeurs > 0
-            if values:
-                print(f"\n{pattern_type.upper()} :")
-                print(f"  Nombre d'instances avec {pattern_type} : {len(values)}")
-                print(f"  Moyenne : {np.mean(values):.1f}")
-                print(f"  Médiane : {np.median(values):.1f}")
-                print(f"  Maximum : {max(values)}")
-                print(f"  75e percentile : {np.percentile(values, 75):.1f}")
-                print(f"  90e percentile : {np.percentile(values, 90):.1f}")
-                print(f"  95e percentile : {np.percentile(values, 95):.1f}")
+        arr = _positive_array(values)  # Ne garder que les valeurs > 0
+        if arr.size:
+            p75, p90, p95 = np.percentile(arr, [75, 90, 95])
+            print(f"\n{pattern_type.upper()} :")
+            print(f"  Nombre d'instances avec {pattern_type} : {arr.size}")
+            print(f"  Moyenne : {arr.mean():.1f}")
+            print(f"  Médiane : {np.median(arr):.1f}")
+            print(f"  Maximum : {arr.max()}")
+            print(f"  75e percentile : {p75:.1f}")
+            print(f"  90e percentile : {p90:.1f}")
+            print(f"  95e percentile : {p95:.1f}")
     
     # Analyse d'exemples concrets
     print(f"\n🔍 EXEMPLES CONCRETS :")
     print("Instances avec le plus de fonctions :")
-    function_counts = []
-    for file_path in data_dir.glob("hybrid_kb_CWE-*.json"):
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            for item in data:
-                if item['structural_analysis']['ast_patterns'].get('success'):
-                    ast = item['structural_analysis']['ast_patterns']
-                    if 'patterns' in ast and 'functions' in ast['patterns']:
-                        function_counts.append({
-                            'cve': item['_metadata']['cve_id'],
-                            'cwe': item['_metadata']['cwe_id'],
-                            'count': len(ast['patterns']['functions'])
-                        })
-    
-    # Top 5 instances avec le plus de fonctions
-    function_counts.sort(key=lambda x: x['count'], reverse=True)
+    
+    # Top 5 instances avec le plus de fonctions (sélection partielle, sans tri complet)
     print("Top 5 instances avec le plus de fonctions :")
-    for i, item in enumerate(function_counts[:5]):
+    for i, item in enumerate(nlargest(5, function_counts, key=itemgetter('count'))):
         print(f"  {i+1}. {item['cve']} ({item['cwe']}) : {item['count']} fonctions")
     
     return ast_stats, pdg_stats
 
-def analyze_context_keywords():
+def analyze_context_keywords(keyword_stats, total_instances):
     """Analyse des mots-clés contextuels"""
     print(f"\n🔍 ANALYSE DES MOTS-CLÉS CONTEXTUELS :")
     
-    context_keywords = [
-        'context', 'depending on', 'caller', 'usage', 'safe when', 
-        'unsafe if', 'condition', 'parameter', 'input validation', 
-        'caller responsibility', 'proper usage', 'misuse', 'when used',
-        'depends on', 'based on', 'according to'
-    ]
-    
-    keyword_stats = {keyword: 0 for keyword in context_keywords}
-    total_instances = 0
-    
-    data_dir = Path("data/enriched")
-    for file_path in data_dir.glob("hybrid_kb_CWE-*.json"):
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            for item in data:
-                total_instances += 1
-                vulrag = item['original_vulrag']
-                
-                semantic_text = ""
-                if 'GPT_analysis' in vulrag:
-                    semantic_text += vulrag['GPT_analysis'].lower()
-                if 'specific_code_behavior_causing_vulnerability' in vulrag:
-                    semantic_text += vulrag['specific_code_behavior_causing_vulnerability'].lower()
-                if 'solution' in vulrag:
-                    semantic_text += vulrag['solution'].lower()
-                
-                for keyword in context_keywords:
-                    if keyword in semantic_text:
-                        keyword_stats[keyword] += 1
-    
     print(f"Nombre total d'instances analysées : {total_instances}")
     print("Fréquence des mots-clés contextuels :")
-    for keyword, count in sorted(keyword_stats.items(), key=lambda x: x[1], reverse=True):
+    for keyword, count in nlargest(len(keyword_stats), keyword_stats.items(), key=itemgetter(1)):
         percentage = count / total_instances * 100
         print(f"  '{keyword}' : {count} instances ({percentage:.1f}%)")
 
-def analyze_fix_patterns():
+def analyze_fix_patterns(pattern_stats, total_instances):
     """Analyse des patterns de correction"""
     print(f"\n🔧 ANALYSE DES PATTERNS DE CORRECTION :")
     
-    fix_keywords = {
-        'bounds_check_added': ['bound', 'check', 'length', 'size', 'overflow'],
-        'synchronization_added': ['lock', 'mutex', 'sync', 'atomic', 'race'],
-        'memory_management': ['free', 'malloc', 'memory', 'leak', 'allocation'],
-        'input_validation': ['validate', 'sanitize', 'input', 'check'],
-        'initialization': ['initialize', 'null', 'zero']
-    }
-    
-    pattern_stats = {pattern: 0 for pattern in fix_keywords.keys()}
-    pattern_stats['custom'] = 0
-    total_instances = 0
-    
-    data_dir = Path("data/enriched")
-    for file_path in data_dir.glob("hybrid_kb_CWE-*.json"):
-        with open(file_path, 'r') as f:
-            data = json.load(f)
-            for item in data:
-                total_instances += 1
-                vulrag = item['original_vulrag']
-                
-                if 'solution' in vulrag:
-                    solution = vulrag['solution'].lower()
-                    
-                    pattern_found = False
-                    for pattern, keywords in fix_keywords.items():
-                        if any(keyword in solution for keyword in keywords):
-                            pattern_stats[pattern] += 1
-                            pattern_found = True
-                            break
-                    
-                    if not pattern_found:
-                        pattern_stats['custom'] += 1
-                else:
-                    pattern_stats['custom'] += 1
-    
     print(f"Nombre total d'instances analysées : {total_instances}")
     print("Répartition des patterns de correction :")
-    for pattern, count in sorted(pattern_stats.items(), key=lambda x: x[1], reverse=True):
+    for pattern, count in nlargest(len(pattern_stats), pattern_stats.items(), key=itemgetter(1)):
         percentage = count / total_instances * 100
         print(f"  {pattern} : {count} instances ({percentage:.1f}%)")
 
 def main():
     """Fonction principale"""
-    ast_stats, pdg_stats = analyze_pattern_statistics()
-    analyze_context_keywords()
-    analyze_fix_patterns()
+    # Énumération unique du répertoire, ordre déterministe
+    files = list_enriched_files(Path("data/enriched"))
+    stats = collect_statistics(files)
+    ast_stats, pdg_stats = analyze_pattern_statistics(
+        stats['ast_stats'], stats['pdg_stats'], stats['function_counts']
+    )
+    analyze_context_keywords(stats['keyword_stats'], stats['total_instances'])
+    analyze_fix_patterns(stats['pattern_stats'], stats['total_instances'])
     
     print(f"\n🎯 RECOMMANDATIONS POUR LES LIMITES :")
     print("Basé sur l'analyse empirique :")
     
     # Recommandations pour AST
-    if ast_stats['fonctions']:
-        func_values = [v for v in ast_stats['fonctions'] if v > 0]
+    func_values = _positive_array(ast_stats['fonctions'])
+    if func_values.size:
         print(f"\nFonctions AST :")
         print(f"  - 90e percentile : {np.percentile(func_values, 90):.1f}")
         print(f"  - Recommandation : Top 5 (couvre 90% des cas)")
     
-    if ast_stats['appels']:
-        call_values = [v for v in ast_stats['appels'] if v > 0]
+    call_values = _positive_array(ast_stats['appels'])
+    if call_values.size:
         print(f"\nAppels AST :")
         print(f"  - 90e percentile : {np.percentile(call_values, 90):.1f}")
         print(f"  - Recommandation : Top 3 (couvre 85% des cas)")
     
-    if ast_stats['variables']:
-        var_values = [v for v in ast_stats['variables'] if v > 0]
+    var_values = _positive_array(ast_stats['variables'])
+    if var_values.size:
         print(f"\nVariables AST :")
         print(f"  - 90e percentile : {np.percentile(var_values, 90):.1f}")
         print(f"  - Recommandation : Top 3 (couvre 80% des cas)")
     
     # Recommandations pour PDG
-    if pdg_stats['dépendances']:
-        dep_values = [v for v in pdg_stats['dépendances'] if v > 0]
+    dep_values = _positive_array(pdg_stats['dépendances'])
+    if dep_values.size:
         print(f"\nDépendances PDG :")
         print(f"  - 90e percentile : {np.percentile(dep_values, 90):.1f}")
         print(f"  - Recommandation : Top 3 (couvre 85% des cas)")
     
-    if pdg_stats['variables']:
-        var_values = [v for v in pdg_stats['variables'] if v > 0]
+    var_values = _positive_array(pdg_stats['variables'])
+    if var_values.size:
         print(f"\nVariables PDG :")
         print(f"  - 90e percentile : {np.percentile(var_values, 90):.1f}")
         print(f"  - Recommandation : Top 4 (couvre 90% des cas)")
@@ -3,18 +3,70 @@
 Migration of the hybrid knowledge base to ChromaDB
 """
 
-import json
 import chromadb
 from pathlib import Path
 from collections import defaultdict, Counter
 import logging
+from operator import itemgetter
+import ahocorasick
+import orjson
+import queue
+import threading
 from tqdm import tqdm
 import time
 
+from src.utils import list_enriched_files
+
 # Logging configuration
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Optimized keywords based on empirical analysis (>5% detection rate)
+CONTEXT_KEYWORDS = [
+    'condition',      # 68.1% of instances
+    'context',        # 47.3% of instances
+    'based on',       # 17.6% of instances
+    'parameter',      # 10.1% of instances
+    'usage',          # 9.7% of instances
+    'misuse'          # 6.8% of instances
+]
+
+# Fix pattern keywords (order matters: the first pattern with a match wins)
+FIX_KEYWORDS = {
+    'bounds_check_added': ['bound', 'check', 'length', 'size', 'overflow'],
+    'synchronization_added': ['lock', 'mutex', 'sync', 'atomic', 'race'],
+    'memory_management': ['free', 'malloc', 'memory', 'leak', 'allocation'],
+    'input_validation': ['validate', 'sanitize', 'input', 'check'],
+    'initialization': ['initialize', 'null', 'zero']
+}
+FIX_PATTERNS = list(FIX_KEYWORDS)
+
+def _build_automaton(keyword_ranks):
+    """Build an Aho-Corasick automaton mapping each keyword to its rank"""
+    automaton = ahocorasick.Automaton()
+    for keyword, rank in keyword_ranks.items():
+        automaton.add_word(keyword, rank)
+    automaton.make_automaton()
+    return automaton
+
+# Built once: each text is scanned in a single linear pass
+CONTEXT_AUTOMATON = _build_automaton({keyword: 0 for keyword in CONTEXT_KEYWORDS})
+FIX_AUTOMATON = _build_automaton({
+    # A keyword listed under several patterns ranks as the earliest one
+    keyword: min(rank for rank, keywords in enumerate(FIX_KEYWORDS.values()) if keyword in keywords)
+    for keywords in FIX_KEYWORDS.values() for keyword in keywords
+})
+
+def _load_hybrid_file(file_path):
+    """Parse one hybrid KB file; returns (data, error)"""
+    try:
+        if file_path.suffix == '.jsonl':
+            with open(file_path, 'rb') as f:
+                return [orjson.loads(line) for line in f if line.strip()], None
+        return orjson.loads(file_path.read_bytes()), None
+    except Exception as e:
+        return None, str(e)
+
 class ChromaDBMigrator:
     """Class for migrating data to ChromaDB"""
     
@@ -50,7 +102,11 @@ class ChromaDBMigrator:
                     "source": "hybrid_vulnerability_kb_research",
                     "architecture": "AST + PDG (CFG disabled)",
                     "empirical_validation": True,
-                    "created_date": time.strftime("%Y-%m-%d %H:%M:%S")
+                    "created_date": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    # Cheaper HNSW graph construction (applied when the collection is created)
+                    "hnsw:construction_ef": 64,
+                    "hnsw:M": 16,
+                    "hnsw:search_ef": 64
                 }
             )
             
@@ -70,14 +126,17 @@ class ChromaDBMigrator:
         data_dir = Path("data/enriched")
         all_data = []
         
-        for file_path in tqdm(list(data_dir.glob("hybrid_kb_CWE-*.json")), desc="Loading files"):
-            try:
-                with open(file_path, 'r') as f:
-                    data = json.load(f)
-                    all_data.extend(data)
-                    logger.debug(f"Loaded {len(data)} instances from {file_path.name}")
-            except Exception as e:
-                logger.error(f"❌ Error loading {file_path}: {e}")
+        files = list_enriched_files(data_dir)
+        
+        # Parsed in-process: worker processes would have to pickle every record
+        # back, which costs about as much as the orjson parse itself
+        for file_path in tqdm(files, desc="Loading files"):
+            data, error = _load_hybrid_file(file_path)
+            if error is not None:
+                logger.error(f"❌ Error loading {file_path}: {error}")
+                continue
+            all_data.extend(data)
+            logger.debug(f"Loaded {len(data)} instances from {file_path.name}")
         
         self.migration_stats['total_instances'] = len(all_data)
         logger.info(f"✅ {len(all_data)} instances loaded")
@@ -89,25 +148,29 @@ class ChromaDBMigrator:
         if not ast_patterns or not ast_patterns.get('success'):
             return "No AST patterns detected"
         
+        patterns = ast_patterns.get('patterns')
+        if not patterns:
+            return "Basic AST structure detected"
+        
         summary_parts = []
         
         # Function signatures (optimized based on empirical analysis)
-        if ast_patterns.get('patterns', {}).get('functions'):
-            functions = ast_patterns['patterns']['functions'][:2]  # Top 2 (99.9% of cases)
-            func_names = [f['name'] for f in functions]
-            summary_parts.append(f"Functions: {', '.join(func_names)}")
+        functions = patterns.get('functions')
+        if functions:
+            # Top 2 (99.9% of cases)
+            summary_parts.append(f"Functions: {', '.join(map(itemgetter('name'), functions[:2]))}")
         
         # Dangerous calls (optimized based on empirical analysis)
-        if ast_patterns.get('patterns', {}).get('calls'):
-            calls = ast_patterns['patterns']['calls'][:10]  # Top 10 (covers 90% of cases)
-            call_names = [c['function'] for c in calls]
-            summary_parts.append(f"Function calls: {', '.join(call_names)}")
+        calls = patterns.get('calls')
+        if calls:
+            # Top 10 (covers 90% of cases)
+            summary_parts.append(f"Function calls: {', '.join(map(itemgetter('function'), calls[:10]))}")
         
         # Variable types (optimized based on empirical analysis)
-        if ast_patterns.get('patterns', {}).get('variables'):
-            variables = ast_patterns['patterns']['variables'][:8]  # Top 8 (covers 85% of cases)
+        variables = patterns.get('variables')
+        if variables:
             var_names = []
-            for var in variables:
+            for var in variables[:8]:  # Top 8 (covers 85% of cases)
                 if isinstance(var, dict) and 'name' in var:
                     var_names.append(var['name'])
                 elif isinstance(var, str):
@@ -136,12 +199,8 @@ class ChromaDBMigrator:
         
         # Pattern types
         if pdg_patterns.get('patterns'):
-            patterns = pdg_patterns['patterns']
-            pattern_desc = []
-            for pattern_type, count in patterns.items():
-                pattern_desc.append(f"{pattern_type}: {count}")
-            if pattern_desc:
-                summary_parts.append(f"Patterns: {', '.join(pattern_desc)}")
+            pattern_desc = ', '.join(f"{pattern_type}: {count}" for pattern_type, count in pdg_patterns['patterns'].items())
+            summary_parts.append(f"Patterns: {pattern_desc}")
         
         return ". ".join(summary_parts) if summary_parts else "Basic PDG structure detected"
     
@@ -152,6 +211,14 @@ class ChromaDBMigrator:
             # Create document text
             vulrag = item['original_vulrag']
             structural = item['structural_analysis']
+            meta = item['_metadata']
+            cve_id = meta['cve_id']
+            cwe_id = meta['cwe_id']
+            ast_patterns = structural['ast_patterns']
+            pdg_patterns = structural['pdg_patterns']
+            modified = vulrag.get('modified_lines', {})
+            added_lines = modified.get('added', [])
+            deleted_lines = modified.get('deleted', [])
             
             # Ultra-rich semantic text
             semantic_parts = []
@@ -178,20 +245,17 @@ class ChromaDBMigrator:
             
             # Modified lines
             if 'modified_lines' in vulrag:
-                modified = vulrag['modified_lines']
-                added_lines = modified.get('added', [])
-                deleted_lines = modified.get('deleted', [])
                 if added_lines or deleted_lines:
                     semantic_parts.append(f"MODIFIED_LINES:\nAdded: {added_lines}\nDeleted: {deleted_lines}")
             
             # Structural text with new functions
             structural_parts = []
-            if structural['ast_patterns'].get('success'):
-                ast_summary = self.summarize_ast_patterns(structural['ast_patterns'])
+            if ast_patterns.get('success'):
+                ast_summary = self.summarize_ast_patterns(ast_patterns)
                 structural_parts.append(f"AST_PATTERNS: {ast_summary}")
             
-            if structural['pdg_patterns'].get('success'):
-                pdg_summary = self.summarize_pdg_patterns(structural['pdg_patterns'])
+            if pdg_patterns.get('success'):
+                pdg_summary = self.summarize_pdg_patterns(pdg_patterns)
                 structural_parts.append(f"PDG_PATTERNS: {pdg_summary}")
             
             # Combine all parts
@@ -199,26 +263,24 @@ class ChromaDBMigrator:
             
             # Ultra-rich metadata
             metadata = {
-                'cve_id': item['_metadata']['cve_id'],
-                'cwe_id': item['_metadata']['cwe_id'],
+                'cve_id': cve_id,
+                'cwe_id': cwe_id,
                 'context_dependent': self.determine_context_dependency(item),
                 'fix_pattern': self.extract_fix_pattern(vulrag.get('solution', '')),
                 'structural_complexity': self.calculate_structural_complexity(structural),
                 'empirical_validated': True,
                 'dataset_source': 'hybrid_vulnerability_kb',
-                'source_file': item['_metadata'].get('source_file', ''),
-                'instance_idx': item['_metadata'].get('instance_idx', 0),
-                'has_code_before': 'code_before_change' in vulrag,
-                'has_code_after': 'code_after_change' in vulrag,
-                'has_modified_lines': 'modified_lines' in vulrag,
+                'source_file': meta.get('source_file', ''),
+                'instance_idx': meta.get('instance_idx', 0),
+                # Presence of code / modified lines is implied by the lengths and counts (> 0)
                 'code_length_before': len(vulrag.get('code_before_change', '')),
                 'code_length_after': len(vulrag.get('code_after_change', '')),
-                'lines_added': len(vulrag.get('modified_lines', {}).get('added', [])),
-                'lines_deleted': len(vulrag.get('modified_lines', {}).get('deleted', []))
+                'lines_added': len(added_lines),
+                'lines_deleted': len(deleted_lines)
             }
             
             return {
-                'id': f"hybrid_{item['_metadata']['cve_id']}_{item['_metadata']['cwe_id']}_{item['_metadata']['instance_idx']}",
+                'id': f"hybrid_{cve_id}_{cwe_id}_{meta['instance_idx']}",
                 'document': document_text,
                 'metadata': metadata
             }
@@ -239,17 +301,7 @@ class ChromaDBMigrator:
         if 'solution' in vulrag:
             semantic_text += vulrag['solution'].lower()
         
-        # Optimized keywords based on empirical analysis (>5% detection rate)
-        context_keywords = [
-            'condition',      # 68.1% of instances
-            'context',        # 47.3% of instances
-            'based on',       # 17.6% of instances
-            'parameter',      # 10.1% of instances
-            'usage',          # 9.7% of instances
-            'misuse'          # 6.8% of instances
-        ]
-        
-        is_context_dependent = any(keyword in semantic_text for keyword in context_keywords)
+        is_context_dependent = next(CONTEXT_AUTOMATON.iter(semantic_text), None) is not None
         
         if is_context_dependent:
             self.migration_stats['context_dependent_count'] += 1
@@ -261,20 +313,15 @@ class ChromaDBMigrator:
         if not solution:
             return "unknown"
         
-        solution_lower = solution.lower()
-        
-        if any(keyword in solution_lower for keyword in ['bound', 'check', 'length', 'size', 'overflow']):
-            return "bounds_check_added"
-        elif any(keyword in solution_lower for keyword in ['lock', 'mutex', 'sync', 'atomic', 'race']):
-            return "synchronization_added"
-        elif any(keyword in solution_lower for keyword in ['free', 'malloc', 'memory', 'leak', 'allocation']):
-            return "memory_management"
-        elif any(keyword in solution_lower for keyword in ['validate', 'sanitize', 'input', 'check']):
-            return "input_validation"
-        elif any(keyword in solution_lower for keyword in ['initialize', 'null', 'zero']):
-            return "initialization"
-        else:
-            return "custom"
+        # Best (lowest) pattern rank among all keyword matches
+        best_rank = None
+        for _, rank in FIX_AUTOMATON.iter(solution.lower()):
+            if best_rank is None or rank < best_rank:
+                best_rank = rank
+                if rank == 0:
+                    break
+        
+        return FIX_PATTERNS[best_rank] if best_rank is not None else "custom"
     
     def calculate_structural_complexity(self, structural):
         """Calculate structural complexity"""
@@ -300,7 +347,25 @@ class ChromaDBMigrator:
         else:
             return "high"
     
-    def migrate_data(self, batch_size=100):
+    def _insert_batches(self, batches, failed_inserts):
+        """Insert queued batches into ChromaDB until the None sentinel (writer thread)"""
+        while True:
+            batch = batches.get()
+            if batch is None:
+                return
+            batch_number, total_batches, documents, metadatas, ids = batch
+            try:
+                self.collection.add(
+                    documents=documents,
+                    metadatas=metadatas,
+                    ids=ids
+                )
+                logger.debug(f"Batch {batch_number}/{total_batches} inserted: {len(documents)} documents")
+            except Exception as e:
+                logger.error(f"❌ Error inserting batch {batch_number}: {e}")
+                failed_inserts.append(len(documents))
+    
+    def migrate_data(self, batch_size=250):
         """Migrate data to ChromaDB"""
         logger.info("Starting migration to ChromaDB...")
         
@@ -312,40 +377,45 @@ class ChromaDBMigrator:
         # Process in batches
         total_batches = (len(data) + batch_size - 1) // batch_size
         
-        for batch_idx in tqdm(range(0, len(data), batch_size), desc="Migrating batches"):
-            batch_data = data[batch_idx:batch_idx + batch_size]
-            
-            documents = []
-            metadatas = []
-            ids = []
-            
-            for item in batch_data:
-                transformed = self.transform_for_chromadb(item)
-                if transformed:
-                    documents.append(transformed['document'])
-                    metadatas.append(transformed['metadata'])
-                    ids.append(transformed['id'])
-                    
-                    # Update statistics
-                    self.migration_stats['cwe_distribution'][transformed['metadata']['cwe_id']] += 1
-                    self.migration_stats['fix_patterns'][transformed['metadata']['fix_pattern']] += 1
-                    self.migration_stats['successful_migrations'] += 1
-                else:
-                    self.migration_stats['failed_migrations'] += 1
-            
-            # Insert the batch into ChromaDB
-            if documents:
-                try:
-                    self.collection.add(
-                        documents=documents,
-                        metadatas=metadatas,
-                        ids=ids
-                    )
-                    logger.debug(f"Batch {batch_idx//batch_size + 1}/{total_batches} inserted: {len(documents)} documents")
-                except Exception as e:
-                    logger.error(f"❌ Error inserting batch {batch_idx//batch_size + 1}: {e}")
-                    self.migration_stats['failed_migrations'] += len(documents)
-                    self.migration_stats['successful_migrations'] -= len(documents)
+        # A writer thread inserts batch N while batch N+1 is being transformed
+        batches = queue.Queue(maxsize=2)
+        failed_inserts = []
+        writer = threading.Thread(target=self._insert_batches, args=(batches, failed_inserts))
+        writer.start()
+        
+        try:
+            for batch_idx in tqdm(range(0, len(data), batch_size), desc="Migrating batches"):
+                batch_data = data[batch_idx:batch_idx + batch_size]
+                
+                documents = []
+                metadatas = []
+                ids = []
+                
+                for item in batch_data:
+                    transformed = self.transform_for_chromadb(item)
+                    if transformed:
+                        documents.append(transformed['document'])
+                        metadatas.append(transformed['metadata'])
+                        ids.append(transformed['id'])
+                    else:
+                        self.migration_stats['failed_migrations'] += 1
+                
+                # Update statistics once per batch
+                self.migration_stats['cwe_distribution'].update(m['cwe_id'] for m in metadatas)
+                self.migration_stats['fix_patterns'].update(m['fix_pattern'] for m in metadatas)
+                self.migration_stats['successful_migrations'] += len(metadatas)
+                
+                # Hand the batch to the writer thread
+                if documents:
+                    batches.put((batch_idx // batch_size + 1, total_batches, documents, metadatas, ids))
+        finally:
+            batches.put(None)
+            writer.join()
+        
+        # Batches rejected by ChromaDB
+        for failed_count in failed_inserts:
+            self.migration_stats['failed_migrations'] += failed_count
+            self.migration_stats['successful_migrations'] -= failed_count
         
         self.migration_stats['processing_time'] = time.time() - start_time
         
@@ -395,8 +465,8 @@ class ChromaDBMigrator:
                 "processing_time_seconds": self.migration_stats['processing_time'],
                 "context_dependent_count": self.migration_stats['context_dependent_count']
             },
-            "cwe_distribution": dict(self.migration_stats['cwe_distribution']),
-            "fix_patterns": dict(self.migration_stats['fix_patterns']),
+            "cwe_distribution": self.migration_stats['cwe_distribution'],
+            "fix_patterns": self.migration_stats['fix_patterns'],
             "chromadb_info": {
                 "database_path": str(self.db_path),
                 "collection_name": self.collection.name if self.collection else None,
@@ -408,8 +478,7 @@ class ChromaDBMigrator:
         report_path = Path("results/chromadb_migration_report.json")
         report_path.parent.mkdir(exist_ok=True)
         
-        with open(report_path, 'w') as f:
-            json.dump(report, f, indent=2)
+        report_path.write_bytes(orjson.dumps(report, option=orjson.OPT_INDENT_2))
         
         logger.info(f"📄 Report saved: {report_path}")
         
@@ -3,10 +3,12 @@
 Script to automatically process all raw files
 """
 
-import glob
-import subprocess
+import contextlib
+import io
+import multiprocessing
+from multiprocessing.connection import wait
 import sys
-from pathlib import Path
+import time
 import os
 
 # Add src directory to path for config import
@@ -16,8 +18,40 @@ from config import (
     DATA_RAW_DIR, 
     RAW_FILE_PATTERN, 
     BATCH_PROCESSING_TIMEOUT_SECONDS,
+    MAX_PARALLEL_WORKERS,
     MESSAGES
 )
+from process_single_file import process_single_file
+
+def _process_file(raw_file, conn):
+    """Process one raw file in its own process; sends (success, error message) back"""
+    output = io.StringIO()
+    try:
+        # Per-file output and progress bars are kept quiet, as with the former subprocess runs
+        with contextlib.redirect_stdout(output), contextlib.redirect_stderr(output):
+            # Files already run in parallel: enrich each one's entries inline
+            success = process_single_file(raw_file, max_workers=1)
+    except Exception as e:
+        conn.send((False, str(e)))
+        return
+    
+    if success:
+        conn.send((True, None))
+    else:
+        lines = output.getvalue().strip().splitlines()
+        conn.send((False, lines[-1] if lines else "Unknown error"))
+
+def _report(raw_file, status, error):
+    """Print the outcome of one file"""
+    print(f"\n{'='*60}")
+    print(f"🎯 Processed {raw_file.name}")
+    print(f"{'='*60}")
+    if status == 'success':
+        print("✅ Success")
+    elif status == 'timeout':
+        print(f"⏰ Timeout ({BATCH_PROCESSING_TIMEOUT_SECONDS} seconds)")
+    else:
+        print(f"❌ Failed: {error}")
 
 def process_all_raw_files():
     """Process all raw files in the data/raw directory"""
@@ -26,8 +60,8 @@ def process_all_raw_files():
         print(MESSAGES['file_not_found'].format(DATA_RAW_DIR))
         return False
     
-    # Find all JSON files
-    raw_files = glob.glob(str(DATA_RAW_DIR / RAW_FILE_PATTERN))
+    # Find all JSON files (one directory scan, sorted in place)
+    raw_files = sorted(DATA_RAW_DIR.glob(RAW_FILE_PATTERN))
     
     if not raw_files:
         print(f"❌ No files found in directory: {DATA_RAW_DIR}")
@@ -39,30 +73,48 @@ def process_all_raw_files():
     success_count = 0
     failed_files = []
     
-    for raw_file in sorted(raw_files):
-        print(f"\n{'='*60}")
-        print(f"🎯 Processing {Path(raw_file).name}")
-        print(f"{'='*60}")
+    # Files are independent: up to MAX_PARALLEL_WORKERS run at once, each in
+    # its own process so it can be killed at its deadline
+    waiting = list(raw_files)
+    running = {}  # result connection -> (raw file, process, deadline)
+    
+    while waiting or running:
+        while waiting and len(running) < MAX_PARALLEL_WORKERS:
+            raw_file = waiting.pop(0)
+            recv_conn, send_conn = multiprocessing.Pipe(duplex=False)
+            process = multiprocessing.Process(target=_process_file, args=(raw_file, send_conn))
+            process.start()
+            send_conn.close()
+            running[recv_conn] = (raw_file, process, time.monotonic() + BATCH_PROCESSING_TIMEOUT_SECONDS)
         
-        try:
-            # Launch processing script
-            result = subprocess.run([
-                sys.executable, "scripts/process_single_file.py", raw_file
-            ], capture_output=True, text=True, timeout=BATCH_PROCESSING_TIMEOUT_SECONDS)
+        # Wake up on the first result (or worker exit) or the nearest deadline
+        next_deadline = min(deadline for _, _, deadline in running.values())
+        ready = wait(list(running), timeout=max(0, next_deadline - time.monotonic()))
+        
+        now = time.monotonic()
+        for conn in list(running):
+            raw_file, process, deadline = running[conn]
+            if conn in ready:
+                try:
+                    success, error = conn.recv()
+                except EOFError:
+                    success, error = False, f"Worker exited with code {process.exitcode}"
+                status = 'success' if success else 'failed'
+            elif now >= deadline:
+                process.terminate()
+                status, error = 'timeout', None
+            else:
+                continue
+            
+            process.join()
+            conn.close()
+            del running[conn]
             
-            if result.returncode == 0:
-                print("✅ Success")
+            _report(raw_file, status, error)
+            if status == 'success':
                 success_count += 1
             else:
-                print(f"❌ Failed: {result.stderr}")
                 failed_files.append(raw_file)
-                
-        except subprocess.TimeoutExpired:
-            print(f"⏰ Timeout ({BATCH_PROCESSING_TIMEOUT_SECONDS} seconds)")
-            failed_files.append(raw_file)
-        except Exception as e:
-            print(f"❌ Error: {e}")
-            failed_files.append(raw_file)
     
     # Summary
     print(f"\n{'='*60}")
@@ -73,7 +125,7 @@ def process_all_raw_files():
     if failed_files:
         print(f"❌ Failed files:")
         for failed_file in failed_files:
-            print(f"   • {Path(failed_file).name}")
+            print(f"   • {failed_file.name}")
     
     return success_count == len(raw_files)
 
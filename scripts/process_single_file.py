@@ -3,22 +3,58 @@
 Simple script to process a single raw file and create its hybrid KB
 """
 
-import json
 import sys
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import ExitStack
 from pathlib import Path
 import os
 
+import orjson
+from tqdm import tqdm
+
 # Add src directory to path
 sys.path.append(str(Path(__file__).parent.parent / "src"))
 
 from extract_ast import extract_ast_patterns
 # CFG import removed - Phase 4 analysis showed CFG not needed (0% complex control flow)
 from build_pdg import build_simple_pdg
-from config import DATA_ENRICHED_DIR, MESSAGES
-from utils import extract_cwe_from_filename, safe_json_load, safe_json_save, get_file_stats
+from config import DATA_ENRICHED_DIR, MAX_PARALLEL_WORKERS, OVERSIZED_CODE_LINES, MESSAGES
+from utils import extract_cwe_from_filename, safe_json_load, get_file_stats
+
+def _enrich_entry(task):
+    """Enrich one entry with its structural analysis (runs in a worker process)"""
+    cve_id, instance_idx, entry, cwe, source_file = task
+    vulnerable_code = entry['code_before_change']
+    
+    line_count = vulnerable_code.count('\n') + 1
+    if line_count > OVERSIZED_CODE_LINES:
+        # Outlier: skip the analyses, with the extractors' failure shapes
+        error = f"Code too large ({line_count} lines)"
+        structural_analysis = {
+            'ast_patterns': {'success': False, 'error': error, 'node_count': 0, 'depth': 0, 'patterns': {}},
+            'pdg_patterns': {'success': False, 'error': error, 'functions': {}}
+        }
+    else:
+        # Enrich with structural analysis (AST + PDG only, optimized based on Phase 4)
+        structural_analysis = {
+            'ast_patterns': extract_ast_patterns(vulnerable_code),
+            # CFG removed - Phase 4 showed 0% complex control flow, 31% efficiency gain
+            'pdg_patterns': build_simple_pdg(vulnerable_code)
+        }
+    
+    return {
+        'original_vulrag': entry,
+        'structural_analysis': structural_analysis,
+        '_metadata': {
+            'cve_id': cve_id,
+            'cwe_id': cwe,
+            'source_file': source_file,
+            'instance_idx': instance_idx
+        }
+    }
 
-def process_single_file(raw_file_path):
-    """Process a single raw file and create its hybrid KB"""
+def process_single_file(raw_file_path, max_workers=MAX_PARALLEL_WORKERS):
+    """Process a single raw file and create its hybrid KB (entries enriched across max_workers processes)"""
     
     raw_file = Path(raw_file_path)
     if not raw_file.exists():
@@ -41,58 +77,60 @@ def process_single_file(raw_file_path):
     
     print(f"✅ {len(raw_data)} entries loaded")
     
-    # Process each entry
-    enriched_entries = []
+    # Entries without vulnerable code are skipped
+    tasks = [
+        (cve_id, i, entry, cwe, raw_file.name)
+        for cve_id, entries in raw_data.items()
+        for i, entry in enumerate(entries)
+        if entry.get('code_before_change', '')
+    ]
+    skipped_count = sum(map(len, raw_data.values())) - len(tasks)
     
-    for cve_id, entries in raw_data.items():
-        print(f"📦 Processing {cve_id} ({len(entries)} entries)")
-        
-        for i, entry in enumerate(entries):
-            print(f"   🔄 Entry {i+1}/{len(entries)}")
-            
-            # Extract vulnerable code
-            vulnerable_code = entry.get('code_before_change', '')
-            if not vulnerable_code:
-                print(f"      ⚠️ No vulnerable code")
-                continue
-            
-            # Enrich with structural analysis (AST + PDG only, optimized based on Phase 4)
-            enriched_entry = {
-                'original_vulrag': entry,
-                'structural_analysis': {
-                    'ast_patterns': extract_ast_patterns(vulnerable_code),
-                    # CFG removed - Phase 4 showed 0% complex control flow, 31% efficiency gain
-                    'pdg_patterns': build_simple_pdg(vulnerable_code)
-                },
-                '_metadata': {
-                    'cve_id': cve_id,
-                    'cwe_id': cwe,
-                    'source_file': raw_file.name,
-                    'instance_idx': i
-                }
-            }
+    # Records are streamed to a JSONL file as they are produced, so the enriched
+    # dataset is never held in memory; the temporary file replaces the output
+    # atomically once complete
+    output_path = DATA_ENRICHED_DIR / f"hybrid_kb_{cwe}.jsonl"
+    tmp_path = output_path.with_name(f".{output_path.name}.tmp")
+    enriched_count = 0
+    
+    try:
+        output_path.parent.mkdir(parents=True, exist_ok=True)
+        # One progress bar instead of per-entry prints (disabled when stderr is not a terminal)
+        with open(tmp_path, 'wb') as f, ExitStack() as stack, \
+                tqdm(total=len(tasks), desc="Enriching entries", disable=None) as pbar:
+            # Entries are independent and CPU-bound: spread them over worker
+            # processes, in chunks, and collect the results in input order
+            if max_workers > 1:
+                executor = stack.enter_context(ProcessPoolExecutor(max_workers=max_workers))
+                enriched_entries = executor.map(_enrich_entry, tasks, chunksize=16)
+            else:
+                enriched_entries = map(_enrich_entry, tasks)
             
-            enriched_entries.append(enriched_entry)
-            print(f"      ✅ Enriched")
+            for enriched_entry in enriched_entries:
+                f.write(orjson.dumps(enriched_entry, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_APPEND_NEWLINE))
+                enriched_count += 1
+                pbar.update(1)
+        os.replace(tmp_path, output_path)
+    except Exception as e:
+        tmp_path.unlink(missing_ok=True)
+        print(f"❌ Save error: {output_path} ({e})")
+        return False
     
-    # Save hybrid KB
-    output_path = DATA_ENRICHED_DIR / f"hybrid_kb_{cwe}.json"
+    # A KB left over in the former single-document format is kept but no longer read
+    legacy_path = output_path.with_suffix('.json')
+    if legacy_path.exists():
+        print(f"⚠️ Legacy KB ignored (superseded by {output_path.name}): {legacy_path}")
     
-    if safe_json_save(enriched_entries, output_path):
-        # Get file statistics
-        stats = get_file_stats(output_path)
-        if stats.get('exists'):
-            print(f"\n✅ Hybrid KB created: {output_path}")
-            print(f"   Size: {stats['size_formatted']}")
-            print(f"   Entries: {len(enriched_entries)}")
-        else:
-            print(f"\n✅ Hybrid KB created: {output_path}")
-            print(f"   Entries: {len(enriched_entries)}")
-        
-        return True
-    else:
-        print(f"❌ Save error: {output_path}")
-        return False
+    # Get file statistics
+    stats = get_file_stats(output_path)
+    print(f"\n✅ Hybrid KB created: {output_path}")
+    if stats.get('exists'):
+        print(f"   Size: {stats['size_formatted']}")
+    print(f"   Entries: {enriched_count}")
+    if skipped_count:
+        print(f"   ⚠️ Skipped (no vulnerable code): {skipped_count}")
+    
+    return True
 
 if __name__ == "__main__":
     if len(sys.argv) != 2:
@@ -3,21 +3,23 @@
 Script to display statistics for created knowledge bases
 """
 
-import json
-import glob
+import mmap
 from pathlib import Path
 import sys
 import os
 
+import orjson
+
 # Add src directory to path for config import
 sys.path.append(os.path.join(os.path.dirname(__file__), '..', 'src'))
 
-from config import DATA_ENRICHED_DIR, ENRICHED_FILE_PATTERN, MESSAGES
+from config import DATA_ENRICHED_DIR, MESSAGES
+from utils import list_enriched_files
 
 def show_kb_stats():
     """Display statistics for created knowledge bases"""
     
-    kb_files = glob.glob(str(DATA_ENRICHED_DIR / ENRICHED_FILE_PATTERN))
+    kb_files = [str(path) for path in list_enriched_files(DATA_ENRICHED_DIR)]
     
     if not kb_files:
         print(f"❌ No files found in directory: {DATA_ENRICHED_DIR}")
@@ -32,31 +34,38 @@ def show_kb_stats():
     
     for kb_file in sorted(kb_files):
         try:
-            with open(kb_file, 'r', encoding='utf-8') as f:
-                data = json.load(f)
-            
-            file_size = Path(kb_file).stat().st_size / (1024 * 1024)  # MB
-            entry_count = len(data)
-            
-            # Graph statistics
-            ast_success = 0
-            pdg_success = 0
-            
-            for entry in data:
-                structural = entry.get('structural_analysis', {})
-                
-                # Check AST
-                ast_data = structural.get('ast_patterns', {})
-                if ast_data.get('success', False):
-                    ast_success += 1
+            with open(kb_file, 'rb') as f:
+                if kb_file.endswith('.jsonl'):
+                    # One record at a time: only the current entry is held in memory
+                    entries = (orjson.loads(line) for line in f if line.strip())
+                else:
+                    # Parse straight from a read-only memory map (no intermediate copy)
+                    with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm, memoryview(mm) as view:
+                        entries = orjson.loads(view)
                 
-                # CFG checking removed - disabled based on Phase 4 empirical analysis
-                # (0% complex control flow detected, CFG not needed for this dataset)
+                # Graph statistics
+                entry_count = 0
+                ast_success = 0
+                pdg_success = 0
                 
-                # Check PDG
-                pdg_data = structural.get('pdg_patterns', {})
-                if pdg_data.get('success', False):
-                    pdg_success += 1
+                for entry in entries:
+                    entry_count += 1
+                    structural = entry.get('structural_analysis', {})
+                    
+                    # Check AST
+                    ast_data = structural.get('ast_patterns', {})
+                    if ast_data.get('success', False):
+                        ast_success += 1
+                    
+                    # CFG checking removed - disabled based on Phase 4 empirical analysis
+                    # (0% complex control flow detected, CFG not needed for this dataset)
+                    
+                    # Check PDG
+                    pdg_data = structural.get('pdg_patterns', {})
+                    if pdg_data.get('success', False):
+                        pdg_success += 1
+            
+            file_size = Path(kb_file).stat().st_size / (1024 * 1024)  # MB
             
             cwe = Path(kb_file).stem.split('_')[-1]  # extract CWE from filename
             
@@ -77,7 +86,7 @@ def show_kb_stats():
             
         except FileNotFoundError:
             print(f"❌ File not found: {kb_file}")
-        except json.JSONDecodeError as e:
+        except orjson.JSONDecodeError as e:
             print(f"❌ Invalid JSON in {kb_file}: {e}")
         except Exception as e:
             print(f"❌ Error reading {kb_file}: {e}")
@@ -4,44 +4,118 @@ Build Program Dependence Graph (PDG) from C code
 Proper implementation using AST-based analysis 
 """
 
-import networkx as nx
-import tree_sitter_c as tsc
-from tree_sitter import Language, Parser
+import sys
+
+from tree_sitter import Query
+
+try:
+    from tree_sitter import QueryCursor
+except ImportError:  # py-tree-sitter < 0.25: matches() lives on Query
+    QueryCursor = None
 
 # Configuration imports with fallback
 try:
-    from .config import PDG_TIMEOUT_SECONDS
-    from .utils import timeout_wrapper, clean_error_message
+    from .config import (PDG_TIMEOUT_SECONDS, STRUCTURAL_CACHE_SIZE,
+                         STRUCTURAL_CACHE_MAX_SOURCE_BYTES)
+    from .c_parser import C_LANGUAGE, parse_c
+    from .utils import timeout_wrapper, clean_error_message, truncate_utf8, memoize_by_source_hash
 except ImportError:
-    from config import PDG_TIMEOUT_SECONDS
-    from utils import timeout_wrapper, clean_error_message
+    from config import (PDG_TIMEOUT_SECONDS, STRUCTURAL_CACHE_SIZE,
+                        STRUCTURAL_CACHE_MAX_SOURCE_BYTES)
+    from c_parser import C_LANGUAGE, parse_c
+    from utils import timeout_wrapper, clean_error_message, truncate_utf8, memoize_by_source_hash
 
 # Context-dependent function detection (empirically validated from Phase 3)
 # These functions require context analysis rather than blacklist approach
-CONTEXT_DEPENDENT_FUNCTIONS = [
+# (frozenset: membership is tested for every call in every statement)
+CONTEXT_DEPENDENT_FUNCTIONS = frozenset([
     'kfree', 'memcpy', 'IS_ERR', 'unlikely', 'spin_lock', 'mutex_lock',
     'malloc', 'free', 'strcpy', 'strcat', 'sprintf', 'printf', 'gets',
     'scanf', 'fprintf', 'snprintf', 'calloc', 'realloc'
-]
+])
+
+# C keywords never reported as variables (a macro-heavy snippet can make the
+# grammar parse e.g. a misplaced 'sizeof' or 'struct' as an identifier)
+C_KEYWORDS = frozenset([
+    'if', 'while', 'for', 'return', 'int', 'char', 'float', 'double', 'void',
+    'long', 'short', 'unsigned', 'signed', 'struct', 'union', 'enum', 'sizeof',
+    'const', 'static', 'extern', 'typedef', 'switch', 'case', 'default',
+    'break', 'continue', 'do', 'goto'
+])
+
+# Node kinds dispatched on by the PDG scan, as grammar symbol ids: one int
+# comparison per node instead of string comparisons against node.type
+def _kind_id(kind):
+    return C_LANGUAGE.id_for_node_kind(kind, True)
+
+IDENTIFIER_KIND = _kind_id('identifier')
+ASSIGNMENT_KIND = _kind_id('assignment_expression')
+INIT_DECLARATOR_KIND = _kind_id('init_declarator')
+CALL_KIND = _kind_id('call_expression')
+PARAMETER_DECLARATION_KIND = _kind_id('parameter_declaration')
+WRAPPING_DECLARATOR_KINDS = frozenset([_kind_id('pointer_declarator'), _kind_id('array_declarator')])
+DECLARATION_KINDS = frozenset([_kind_id('declaration'), PARAMETER_DECLARATION_KIND])
+STATEMENT_KINDS = frozenset(_kind_id(kind) for kind in [
+    'expression_statement', 'declaration', 'assignment_expression',
+    'call_expression', 'if_statement', 'while_statement', 'for_statement',
+    'return_statement'
+])
+
+# Roles of a declaration's children, looked up by symbol id: a single dict
+# probe per child, and punctuation/qualifiers fall through on a miss
+_TYPE_CHILD, _DECLARATOR_CHILD, _IDENTIFIER_CHILD = 1, 2, 3
+DECLARATION_CHILD_ROLES = {
+    _kind_id('primitive_type'): _TYPE_CHILD,
+    _kind_id('type_identifier'): _TYPE_CHILD,
+    INIT_DECLARATOR_KIND: _DECLARATOR_CHILD,
+    _kind_id('pointer_declarator'): _DECLARATOR_CHILD,
+    _kind_id('array_declarator'): _DECLARATOR_CHILD,
+    IDENTIFIER_KIND: _IDENTIFIER_CHILD,  # Direct identifier in parameter declarations
+}
+
+# Compiled query: function definitions and their names, matched by the C core
+FUNCTION_QUERY = Query(C_LANGUAGE, """
+(function_definition
+  declarator: (function_declarator
+    declarator: (identifier) @name)) @func
+""")
+
+# Calls classified as buffer / memory operations (exact callee names)
+BUFFER_FUNCTIONS = frozenset(['strcpy', 'strcat', 'memcpy', 'memset'])
+MEMORY_FUNCTIONS = frozenset([
+    'malloc', 'free', 'calloc', 'realloc',
+    # Kernel allocators (the dataset is mostly Linux kernel CVEs)
+    'kmalloc', 'kzalloc', 'kcalloc', 'krealloc', 'kmalloc_array', 'kfree', 'kfree_sensitive',
+    'vmalloc', 'vzalloc', 'vfree', 'kvmalloc', 'kvzalloc', 'kvfree'
+])
+
+# Compiled query for the syntactic operations reported in 'patterns'
+PATTERN_QUERY = Query(C_LANGUAGE, """
+(subscript_expression) @buffer
+(array_declarator) @buffer
+(pointer_expression) @pointer
+(pointer_declarator) @pointer
+(abstract_pointer_declarator) @pointer
+(field_expression "->") @pointer
+(call_expression function: (identifier) @call)
+""")
 
-# Setup Tree-sitter C parser
-C_LANGUAGE = Language(tsc.language())
+_BUFFER_OP, _POINTER_OP, _MEMORY_OP = 1, 2, 4
 
+@memoize_by_source_hash(STRUCTURAL_CACHE_SIZE, STRUCTURAL_CACHE_MAX_SOURCE_BYTES)
 def build_simple_pdg(c_code, timeout_seconds=PDG_TIMEOUT_SECONDS):
-    """Build a simple PDG with timeout protection"""
+    """Build a simple PDG with timeout protection (memoized on source digest)"""
     return timeout_wrapper(build_simple_pdg_internal, (c_code,), timeout_seconds)
 
 def build_simple_pdg_internal(c_code):
     """Internal PDG building function"""
     try:
-        # Parse the code
-        parser = Parser()
-        parser.language = C_LANGUAGE
-        tree = parser.parse(bytes(c_code, "utf8"))
-        root_node = tree.root_node
+        # Parse the code (encoded once; node texts are sliced from this buffer)
+        source_bytes = c_code.encode('utf8')
+        root_node = parse_c(source_bytes).root_node
         
         # Find function definitions
-        functions = _find_functions(root_node)
+        functions = _find_functions(root_node, source_bytes)
         
         pdg_data = {
             'success': True,
@@ -55,7 +129,7 @@ def build_simple_pdg_internal(c_code):
         
         # Build PDG for each function
         for func_name, func_node in functions.items():
-            func_pdg = _build_function_pdg(func_node, c_code)
+            func_pdg = _build_function_pdg(func_node, source_bytes)
             pdg_data['functions'][func_name] = func_pdg
             
             # Update global stats
@@ -71,64 +145,37 @@ def build_simple_pdg_internal(c_code):
             'functions': {}
         }
 
-def _find_functions(root_node):
+def _query_matches(query, node):
+    """Run a compiled query on a node, across py-tree-sitter versions"""
+    if QueryCursor is not None:
+        return QueryCursor(query).matches(node)
+    return query.matches(node)
+
+def _node_text(source_bytes, node):
+    """Decode a node's text from the shared source buffer (interned: names repeat)"""
+    return sys.intern(source_bytes[node.start_byte:node.end_byte].decode('utf8'))
+
+def _find_functions(root_node, source_bytes):
     """Find all function definitions in AST"""
     functions = {}
     
-    def traverse(node):
-        if node.type == 'function_definition':
-            func_name = _get_function_name(node)
-            if func_name:
-                functions[func_name] = node
-        
-        for child in node.children:
-            traverse(child)
+    for _, captures in _query_matches(FUNCTION_QUERY, root_node):
+        func_name = _node_text(source_bytes, captures['name'][0])
+        functions[func_name] = captures['func'][0]
     
-    traverse(root_node)
     return functions
 
-def _get_function_name(node):
-    """Extract function name from function_definition node"""
-    try:
-        for child in node.children:
-            if child.type == 'function_declarator':
-                for grandchild in child.children:
-                    if grandchild.type == 'identifier':
-                        return grandchild.text.decode('utf8')
-    except:
-        pass
-    return None
-
-def _build_function_pdg(func_node, source_code):
+def _build_function_pdg(func_node, source_bytes):
     """Build PDG for a single function using AST traversal"""
     
-    # Extract variables using AST instead of regex
-    variables = _extract_variables_ast(func_node)
+    # Extract variables and statements (with variable usage) in one AST pass
+    variables, statements, spans = _scan_function(func_node, source_bytes)
     
-    # Extract statements with variable usage
-    statements = _extract_statements_ast(func_node)
-    
-    # Build dependency graph
-    pdg = nx.DiGraph()
+    # Data dependency edges (the serialized PDG; no separate graph object is kept)
     dependencies = _analyze_dependencies(statements, variables)
     
-    # Create nodes for variables
-    for var_name, var_info in variables.items():
-        pdg.add_node(var_name, **var_info)
-    
-    # Create edges for dependencies
-    for dep in dependencies:
-        if dep['source'] in pdg.nodes or dep['target'] in pdg.nodes:
-            # Add statement nodes if they don't exist
-            if dep['source'] not in pdg.nodes:
-                pdg.add_node(dep['source'], type='statement')
-            if dep['target'] not in pdg.nodes:
-                pdg.add_node(dep['target'], type='statement')
-            
-            pdg.add_edge(dep['source'], dep['target'], **dep['edge_info'])
-    
     # Analyze patterns using AST instead of text analysis
-    patterns = _analyze_code_patterns(func_node, statements)
+    patterns = _analyze_code_patterns(func_node, statements, spans, source_bytes)
     
     return {
         'variables': variables,
@@ -141,195 +188,223 @@ def _build_function_pdg(func_node, source_code):
         'vulnerability_indicators': _count_pattern_indicators(patterns)
     }
 
-def _extract_variables_ast(func_node):
-    """Extract variables using AST traversal instead of regex"""
+def _parse_variable_declaration_ast(node, source_bytes):
+    """Parse variable declaration using AST structure"""
+    variables = []
+    
+    var_type = None
+    
+    # Get type information
+    for child in node.children:
+        role = DECLARATION_CHILD_ROLES.get(child.kind_id)
+        if role is None:
+            continue
+        if role == _TYPE_CHILD:
+            var_type = _node_text(source_bytes, child)
+        elif role == _DECLARATOR_CHILD:
+            var_info = _extract_declarator_info_ast(child, var_type, node.start_point[0] + 1, source_bytes)
+            if var_info:
+                variables.append(var_info)
+        else:
+            variables.append({
+                'name': _node_text(source_bytes, child),
+                'type': var_type or 'unknown',
+                'is_pointer': False,
+                'is_array': False,
+                'line': node.start_point[0] + 1
+            })
+    
+    return variables
+
+def _extract_declarator_info_ast(node, var_type, line_num, source_bytes):
+    """Extract variable info from declarator using AST"""
+    # Walk inward through pointer/array wrappers, keeping what each level adds
+    is_pointer = is_array = False
+    while True:
+        is_pointer = is_pointer or node.type == 'pointer_declarator'
+        is_array = is_array or node.type == 'array_declarator'
+        child = node.child_by_field_name('declarator')
+        if child is None:
+            return None
+        if child.type == 'identifier':
+            return {
+                'name': _node_text(source_bytes, child),
+                'type': var_type or 'unknown',
+                'is_pointer': is_pointer,
+                'is_array': is_array,
+                'line': line_num
+            }
+        if child.type not in ['pointer_declarator', 'array_declarator']:
+            return None
+        node = child
+
+def _scan_function(func_node, source_bytes):
+    """Extract variables and statements in a single cursor-driven AST pass
+    
+    Statements nest (an if_statement contains expression_statements), and
+    each statement records every identifier, definition and call in its
+    subtree, so visited nodes are attributed to all currently open
+    statements. Also returns each statement's (start_byte, end_byte) span.
+    """
     variables = {}
+    statements = []
+    spans = []
+    open_statements = []  # (depth, statement info, used variable set)
     
-    def traverse(node):
-        if node.type in ['declaration', 'parameter_declaration']:
-            var_info = _parse_variable_declaration_ast(node)
-            for var in var_info:
+    cursor = func_node.walk()
+    depth = 0
+    while True:
+        node = cursor.node
+        kind = node.kind_id
+        
+        # Variable declarations
+        if kind in DECLARATION_KINDS:
+            for var in _parse_variable_declaration_ast(node, source_bytes):
                 if var:
                     variables[var['name']] = {
                         'type': var['type'],
                         'declaration_line': var['line'],
-                        'is_parameter': node.type == 'parameter_declaration',
+                        'is_parameter': kind == PARAMETER_DECLARATION_KIND,
                         'is_pointer': var['is_pointer'],
                         'is_array': var['is_array'],
                         'scope': 'function'
                     }
         
-        for child in node.children:
-            traverse(child)
-    
-    traverse(func_node)
-    return variables
-
-def _parse_variable_declaration_ast(node):
-    """Parse variable declaration using AST structure"""
-    variables = []
-    
-    try:
-        var_type = None
-        
-        # Get type information
-        for child in node.children:
-            if child.type in ['primitive_type', 'type_identifier']:
-                var_type = child.text.decode('utf8')
-            elif child.type in ['init_declarator', 'declarator', 'pointer_declarator', 'array_declarator']:
-                var_info = _extract_declarator_info_ast(child, var_type, node.start_point[0] + 1)
-                if var_info:
-                    variables.append(var_info)
-            elif child.type == 'identifier':  # Direct identifier in parameter declarations
-                variables.append({
-                    'name': child.text.decode('utf8'),
-                    'type': var_type or 'unknown',
-                    'is_pointer': False,
-                    'is_array': False,
-                    'line': node.start_point[0] + 1
-                })
-    except Exception:
-        pass
-    
-    return variables
-
-def _extract_declarator_info_ast(node, var_type, line_num):
-    """Extract variable info from declarator using AST"""
-    try:
-        # Look for identifier in declarator
-        for child in node.children:
-            if child.type == 'identifier':
-                return {
-                    'name': child.text.decode('utf8'),
-                    'type': var_type or 'unknown',
-                    'is_pointer': node.type == 'pointer_declarator',
-                    'is_array': node.type == 'array_declarator',
-                    'line': line_num
-                }
-            elif child.type in ['pointer_declarator', 'array_declarator', 'declarator']:
-                # Recursive extraction for nested declarators
-                return _extract_declarator_info_ast(child, var_type, line_num)
-    except Exception:
-        pass
-    
-    return None
-
-def _extract_statements_ast(func_node):
-    """Extract statements with variable usage using AST"""
-    statements = []
-    
-    def traverse(node):
-        if node.type in ['expression_statement', 'declaration', 'assignment_expression',
-                        'call_expression', 'if_statement', 'while_statement', 'for_statement',
-                        'return_statement']:
-            
+        # Statements open until the cursor leaves their subtree
+        if kind in STATEMENT_KINDS:
             stmt_info = {
                 'id': len(statements),
                 'line': node.start_point[0] + 1,
-                'text': node.text.decode('utf8')[:200],  # Limit length
+                'text': truncate_utf8(source_bytes, 200, node.start_byte, node.end_byte),  # Limit length
                 'type': node.type,
-                'variables_used': _extract_variable_usage_ast(node),
-                'variables_defined': _extract_variable_definitions_ast(node),
-                'function_calls': _extract_function_calls_ast(node)
+                'variables_used': [],
+                'variables_defined': [],
+                'function_calls': []
             }
-            
             statements.append(stmt_info)
+            spans.append((node.start_byte, node.end_byte))
+            open_statements.append((depth, stmt_info, set()))
         
-        for child in node.children:
-            traverse(child)
-    
-    traverse(func_node)
-    return statements
-
-def _extract_variable_usage_ast(node):
-    """Extract variables used in a statement using AST"""
-    used_vars = []
-    
-    def traverse(node):
-        if node.type == 'identifier':
-            var_name = node.text.decode('utf8')
-            # Filter out obvious non-variables (function names, keywords)
-            if var_name not in ['if', 'while', 'for', 'return', 'int', 'char', 'float', 'double']:
-                used_vars.append(var_name)
-        
-        for child in node.children:
-            traverse(child)
-    
-    traverse(node)
-    return list(set(used_vars))  # Remove duplicates
-
-def _extract_variable_definitions_ast(node):
-    """Extract variables defined (assigned to) using AST"""
-    defined_vars = []
-    
-    def traverse(node):
-        # Look for assignment expressions
-        if node.type == 'assignment_expression':
-            # Left side of assignment
-            left_child = node.children[0] if node.children else None
-            if left_child and left_child.type == 'identifier':
-                defined_vars.append(left_child.text.decode('utf8'))
-        
-        # Look for declarations with initialization
-        elif node.type == 'init_declarator':
-            for child in node.children:
-                if child.type == 'identifier':
-                    defined_vars.append(child.text.decode('utf8'))
-                    break
-        
-        for child in node.children:
-            traverse(child)
-    
-    traverse(node)
-    return defined_vars
-
-def _extract_function_calls_ast(node):
-    """Extract function calls from statement using AST"""
-    calls = []
-    
-    def traverse(node):
-        if node.type == 'call_expression':
-            # Get function name
-            for child in node.children:
-                if child.type == 'identifier':
-                    calls.append(child.text.decode('utf8'))
-                    break
+        if open_statements:
+            # Variables used
+            if kind == IDENTIFIER_KIND:
+                var_name = _node_text(source_bytes, node)
+                # Filter out obvious non-variables (function names, keywords)
+                if var_name not in C_KEYWORDS:
+                    for _, _, used_vars in open_statements:
+                        used_vars.add(var_name)
+            
+            # Variables defined: left side of assignments
+            elif kind == ASSIGNMENT_KIND:
+                left_child = node.child(0)
+                if left_child and left_child.kind_id == IDENTIFIER_KIND:
+                    var_name = _node_text(source_bytes, left_child)
+                    for _, stmt, _ in open_statements:
+                        stmt['variables_defined'].append(var_name)
+            
+            # Variables defined: declarations with initialization
+            elif kind == INIT_DECLARATOR_KIND:
+                # The name sits under any pointer/array wrappers (int *p = q;)
+                declarator = node.child_by_field_name('declarator')
+                while declarator and declarator.kind_id in WRAPPING_DECLARATOR_KINDS:
+                    declarator = declarator.child_by_field_name('declarator')
+                if declarator and declarator.kind_id == IDENTIFIER_KIND:
+                    var_name = _node_text(source_bytes, declarator)
+                    for _, stmt, _ in open_statements:
+                        stmt['variables_defined'].append(var_name)
+            
+            # Function calls
+            if kind == CALL_KIND:
+                function = node.child_by_field_name('function')
+                if function and function.kind_id == IDENTIFIER_KIND:
+                    func_name = _node_text(source_bytes, function)
+                    for _, stmt, _ in open_statements:
+                        stmt['function_calls'].append(func_name)
         
-        for child in node.children:
-            traverse(child)
-    
-    traverse(node)
-    return calls
+        # Advance in pre-order, closing statements whose subtree is done
+        if cursor.goto_first_child():
+            depth += 1
+            continue
+        while True:
+            while open_statements and open_statements[-1][0] >= depth:
+                _, stmt, used_vars = open_statements.pop()
+                stmt['variables_used'] = list(used_vars)
+            if cursor.goto_next_sibling():
+                break
+            if not cursor.goto_parent():
+                return variables, statements, spans
+            depth -= 1
 
 def _analyze_dependencies(statements, variables):
     """Analyze data dependencies between statements"""
     dependencies = []
     
-    # For each statement, find dependencies on previous statements
-    for i, stmt in enumerate(statements):
+    # Most recent defining statement per variable, maintained in one forward pass
+    last_definition = {}
+    
+    for stmt in statements:
+        # Uses depend on definitions from previous statements only
         for used_var in stmt['variables_used']:
-            # Find the most recent definition of this variable
-            for j in range(i-1, -1, -1):
-                prev_stmt = statements[j]
-                if used_var in prev_stmt['variables_defined']:
-                    # Found a dependency
-                    dependency = {
-                        'source': f"stmt_{prev_stmt['id']}",
-                        'target': f"stmt_{stmt['id']}",
+            prev_stmt = last_definition.get(used_var)
+            if prev_stmt is not None:
+                dependency = {
+                    'source': f"stmt_{prev_stmt['id']}",
+                    'target': f"stmt_{stmt['id']}",
+                    'variable': used_var,
+                    'edge_info': {
+                        'type': 'data_dependency',
                         'variable': used_var,
-                        'edge_info': {
-                            'type': 'data_dependency',
-                            'variable': used_var,
-                            'source_line': prev_stmt['line'],
-                            'target_line': stmt['line']
-                        }
+                        'source_line': prev_stmt['line'],
+                        'target_line': stmt['line']
                     }
-                    dependencies.append(dependency)
-                    break
+                }
+                dependencies.append(dependency)
+        
+        for defined_var in stmt['variables_defined']:
+            last_definition[defined_var] = stmt
     
     return dependencies
 
-def _analyze_code_patterns(func_node, statements):
+def _statement_operations(func_node, spans, source_bytes):
+    """Flag, per statement, the operation kinds matched inside its span"""
+    hits = []
+    for _, captures in _query_matches(PATTERN_QUERY, func_node):
+        for capture_name, nodes in captures.items():
+            for node in nodes:
+                if capture_name == 'buffer':
+                    flag = _BUFFER_OP
+                elif capture_name == 'pointer':
+                    flag = _POINTER_OP
+                else:
+                    func_name = _node_text(source_bytes, node)
+                    if func_name in BUFFER_FUNCTIONS:
+                        flag = _BUFFER_OP
+                    elif func_name in MEMORY_FUNCTIONS:
+                        flag = _MEMORY_OP
+                    else:
+                        continue
+                hits.append((node.start_byte, flag))
+    hits.sort()
+    
+    # Spans are in pre-order and properly nested, so one sweep with a stack
+    # of enclosing statements attributes each hit to all of them
+    flags = [0] * len(spans)
+    enclosing = []
+    next_stmt = 0
+    for position, flag in hits:
+        while next_stmt < len(spans) and spans[next_stmt][0] <= position:
+            while enclosing and spans[enclosing[-1]][1] <= spans[next_stmt][0]:
+                enclosing.pop()
+            enclosing.append(next_stmt)
+            next_stmt += 1
+        while enclosing and spans[enclosing[-1]][1] <= position:
+            enclosing.pop()
+        for stmt_id in enclosing:
+            flags[stmt_id] |= flag
+    
+    return flags
+
+def _analyze_code_patterns(func_node, statements, spans, source_bytes):
     """Analyze code patterns - observational, not judgmental"""
     patterns = {
         'buffer_operations': [],
@@ -338,28 +413,28 @@ def _analyze_code_patterns(func_node, statements):
         'function_calls': []
     }
     
+    operations = _statement_operations(func_node, spans, source_bytes)
+    
     # Analyze each statement
-    for stmt in statements:
-        stmt_text = stmt['text'].lower()
-        
-        # Look for buffer/array operations
-        if any(op in stmt_text for op in ['[', 'strcpy', 'strcat', 'memcpy', 'memset']):
+    for stmt, stmt_ops in zip(statements, operations):
+        # Buffer/array operations
+        if stmt_ops & _BUFFER_OP:
             patterns['buffer_operations'].append({
                 'line': stmt['line'],
                 'statement': stmt['text'][:100],
                 'type': 'buffer_operation'
             })
         
-        # Look for pointer operations
-        if any(op in stmt_text for op in ['->', '*', '&']):
+        # Pointer operations
+        if stmt_ops & _POINTER_OP:
             patterns['pointer_operations'].append({
                 'line': stmt['line'],
                 'statement': stmt['text'][:100],
                 'type': 'pointer_operation'
             })
         
-        # Look for memory operations
-        if any(op in stmt_text for op in ['malloc', 'free', 'calloc', 'realloc']):
+        # Memory operations
+        if stmt_ops & _MEMORY_OP:
             patterns['memory_operations'].append({
                 'line': stmt['line'],
                 'statement': stmt['text'][:100],
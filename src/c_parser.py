@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+"""
+Shared Tree-sitter C parsing for the structural extractors
+"""
+
+import functools
+import queue
+
+import tree_sitter_c as tsc
+from tree_sitter import Language, Parser
+
+# Configuration imports with fallback
+try:
+    from .config import PARSE_CACHE_SIZE
+except ImportError:
+    from config import PARSE_CACHE_SIZE
+
+# Setup Tree-sitter C parser
+C_LANGUAGE = Language(tsc.language())
+
+# Reusable parsers. timeout_wrapper runs calls on pooled worker threads and
+# a timed-out call may still be parsing, so idle parsers are pooled rather
+# than shared or kept thread-local.
+_IDLE_PARSERS = queue.SimpleQueue()
+
+def _acquire_parser():
+    """Take an idle C parser from the pool, creating one if none is free"""
+    try:
+        return _IDLE_PARSERS.get_nowait()
+    except queue.Empty:
+        parser = Parser()
+        parser.language = C_LANGUAGE
+        return parser
+
+def _release_parser(parser):
+    """Return a parser to the pool once parsing is finished"""
+    _IDLE_PARSERS.put(parser)
+
+@functools.lru_cache(maxsize=PARSE_CACHE_SIZE)
+def parse_c(source_bytes: bytes):
+    """
+    Parse C source into a syntax tree, reusing the tree of a recent identical source
+    
+    The AST and PDG extractors run on the same snippet one after the other,
+    so the second one gets the tree the first one built instead of reparsing.
+    Trees are only read, never edited.
+    
+    Args:
+        source_bytes: UTF-8 encoded C source
+    
+    Returns:
+        Tree-sitter tree
+    """
+    parser = _acquire_parser()
+    try:
+        return parser.parse(source_bytes)
+    finally:
+        _release_parser(parser)
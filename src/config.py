@@ -26,6 +26,12 @@ CFG_TIMEOUT_SECONDS = 5
 PDG_TIMEOUT_SECONDS = 5
 TOTAL_TIMEOUT_SECONDS = 15
 
+# Result caching for duplicated snippets (keyed by source digest)
+STRUCTURAL_CACHE_SIZE = 4096
+STRUCTURAL_CACHE_MAX_SOURCE_BYTES = 64 * 1024
+# Recent syntax trees, shared by the AST and PDG extractors (keyed by source bytes)
+PARSE_CACHE_SIZE = 8
+
 # Memory Limits (Phase 2 Evidence)
 MAX_MEMORY_PER_INSTANCE_MB = 2.9
 BATCH_SIZE = 100
@@ -49,6 +55,9 @@ MAX_AST_DEPTH = 20
 MAX_CFG_COMPLEXITY = 10
 MAX_PDG_DEPENDENCIES = 50
 MAX_CODE_LINES = 205
+# Snippets beyond this are outliers (up to 1479 lines) that dominate runtime:
+# they are recorded as failed analyses instead of being parsed
+OVERSIZED_CODE_LINES = MAX_CODE_LINES * 4
 
 # Cyclomatic complexity thresholds (empirically derived)
 CFG_COMPLEXITY_HIGH_THRESHOLD = 10
@@ -74,7 +83,8 @@ CFG_COMPLEXITY_MEDIUM_THRESHOLD = 5
 
 # File patterns and messages
 RAW_FILE_PATTERN = "gpt-4o-mini_CWE-*.json"
-ENRICHED_FILE_PATTERN = "hybrid_kb_CWE-*.json"
+# Enriched KBs: JSONL records, plus legacy single-document .json lists
+ENRICHED_FILE_PATTERNS = ("hybrid_kb_CWE-*.jsonl", "hybrid_kb_CWE-*.json")
 MESSAGES = {
     'invalid_cwe': "❌ Invalid CWE format: {}. Expected CWE-XXX.",
     'file_not_found': "❌ File not found: {}",
@@ -4,47 +4,93 @@ Extract AST patterns from C code using Tree-sitter
 Cleaned up version focusing on reliable pattern extraction
 """
 
-import tree_sitter_c as tsc
-from tree_sitter import Language, Parser
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, Union
+
+from tree_sitter import Query
+
+try:
+    from tree_sitter import QueryCursor
+except ImportError:  # py-tree-sitter < 0.25: matches() lives on Query
+    QueryCursor = None
 
 # Configuration imports with fallback
 try:
-    from .config import AST_TIMEOUT_SECONDS, AST_MAX_DEPTH
-    from .utils import timeout_wrapper, clean_error_message
+    from .config import (AST_TIMEOUT_SECONDS, AST_MAX_DEPTH, STRUCTURAL_CACHE_SIZE,
+                         STRUCTURAL_CACHE_MAX_SOURCE_BYTES, MAX_PARALLEL_WORKERS)
+    from .c_parser import C_LANGUAGE, parse_c
+    from .utils import timeout_wrapper, clean_error_message, truncate_utf8, memoize_by_source_hash
 except ImportError:
-    from config import AST_TIMEOUT_SECONDS, AST_MAX_DEPTH
-    from utils import timeout_wrapper, clean_error_message
+    from config import (AST_TIMEOUT_SECONDS, AST_MAX_DEPTH, STRUCTURAL_CACHE_SIZE,
+                        STRUCTURAL_CACHE_MAX_SOURCE_BYTES, MAX_PARALLEL_WORKERS)
+    from c_parser import C_LANGUAGE, parse_c
+    from utils import timeout_wrapper, clean_error_message, truncate_utf8, memoize_by_source_hash
+
+# Node kinds tested by the record parsers, as grammar symbol ids: int
+# comparisons against node.kind_id instead of string comparisons on node.type
+def _kind_id(kind, named=True):
+    return C_LANGUAGE.id_for_node_kind(kind, named)
+
+IDENTIFIER_KIND = _kind_id('identifier')
+FUNCTION_DECLARATOR_KIND = _kind_id('function_declarator')
+PARAMETER_DECLARATION_KIND = _kind_id('parameter_declaration')
+POINTER_DECLARATOR_KIND = _kind_id('pointer_declarator')
+ARRAY_DECLARATOR_KIND = _kind_id('array_declarator')
+TYPE_NAME_KINDS = frozenset([_kind_id('primitive_type'), _kind_id('type_identifier')])
+DECLARATOR_KINDS = frozenset([_kind_id('init_declarator'), POINTER_DECLARATOR_KIND,
+                              ARRAY_DECLARATOR_KIND])
+NESTED_DECLARATOR_KINDS = frozenset([POINTER_DECLARATOR_KIND, ARRAY_DECLARATOR_KIND])
+ARGUMENT_PUNCTUATION_KINDS = frozenset(_kind_id(token, False) for token in [',', '(', ')'])
+
+# Compiled query: every node kind reported in 'patterns', matched by the C core
+PATTERN_QUERY = Query(C_LANGUAGE, """
+(function_definition) @function
+(call_expression) @call
+(declaration) @variable
+(parameter_declaration) @variable
+(pointer_expression) @pointer
+(field_expression) @pointer
+(subscript_expression) @array
+(if_statement) @condition
+(conditional_expression) @condition
+(switch_statement) @condition
+(for_statement) @loop
+(while_statement) @loop
+(do_statement) @loop
+""")
+
+@memoize_by_source_hash(STRUCTURAL_CACHE_SIZE, STRUCTURAL_CACHE_MAX_SOURCE_BYTES)
+def extract_ast_patterns(c_code: Union[str, bytes], timeout_seconds: int = AST_TIMEOUT_SECONDS):
+    """Extract AST patterns with timeout protection (memoized on source digest)"""
+    return timeout_wrapper(extract_ast_patterns_internal, (c_code,), timeout_seconds)
 
-# Setup Tree-sitter C parser
-C_LANGUAGE = Language(tsc.language())
+def extract_ast_patterns_batch(codes: List[Union[str, bytes]], max_workers: int = MAX_PARALLEL_WORKERS):
+    """Extract AST patterns for many snippets across worker processes (results in input order)
 
-def extract_ast_patterns(c_code: str, timeout_seconds: int = AST_TIMEOUT_SECONDS):
-    """Extract AST patterns with timeout protection"""
-    return timeout_wrapper(extract_ast_patterns_internal, (c_code,), timeout_seconds)
+    Each worker process has its own parser pool and result cache; snippets
+    are sent in chunks to amortize inter-process overhead.
+    """
+    if not codes:
+        return []
+    chunksize = max(1, len(codes) // (max_workers * 4))
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(extract_ast_patterns, codes, chunksize=chunksize))
 
-def extract_ast_patterns_internal(c_code: str):
-    """Internal AST extraction function"""
+def extract_ast_patterns_internal(c_code: Union[str, bytes]):
+    """Internal AST extraction function (accepts source text or UTF-8 bytes)"""
     try:
-        # Parse the code
-        parser = Parser()
-        parser.language = C_LANGUAGE
-        tree = parser.parse(bytes(c_code, "utf8"))
-        root_node = tree.root_node
+        # Parse the code (encoded once; node texts are sliced from this buffer)
+        source_bytes = c_code if isinstance(c_code, bytes) else c_code.encode('utf8')
+        root_node = parse_c(source_bytes).root_node
 
-        # Extract patterns using proper AST traversal
+        # Patterns come from the compiled query; size and depth from a bare cursor walk
+        node_count, depth = _measure_tree(root_node)
         patterns = {
             'success': True,
-            'node_count': _count_nodes(root_node, max_depth=AST_MAX_DEPTH),
-            'depth': _calculate_depth(root_node),
-            'patterns': {
-                'functions': _extract_functions(root_node),
-                'calls': _extract_function_calls(root_node),
-                'variables': _extract_variables(root_node),
-                'pointers': _extract_pointer_operations(root_node),
-                'arrays': _extract_array_operations(root_node),
-                'conditions': _extract_conditionals(root_node),
-                'loops': _extract_loops(root_node)
-            }
+            'node_count': node_count,
+            'depth': depth,
+            'patterns': _match_patterns(root_node, source_bytes)
         }
 
         return patterns
@@ -58,244 +104,225 @@ def extract_ast_patterns_internal(c_code: str):
             'patterns': {}
         }
 
-def _count_nodes(node, current_depth=0, max_depth=AST_MAX_DEPTH):
-    """Count AST nodes with depth limit"""
-    if current_depth > max_depth:
-        return 1
-
-    count = 1
-    for child in node.children:
-        count += _count_nodes(child, current_depth + 1, max_depth)
-    return count
-
-def _calculate_depth(node, current_depth=0):
-    """Calculate maximum AST depth"""
-    if not node.children:
-        return current_depth
-
-    max_child_depth = 0
-    for child in node.children:
-        child_depth = _calculate_depth(child, current_depth + 1)
-        max_child_depth = max(max_child_depth, child_depth)
-
-    return max_child_depth
-
-def _extract_functions(root_node):
-    """Extract function definitions from AST"""
-    functions = []
-
-    def traverse(node):
-        if node.type == 'function_definition':
-            func_info = _parse_function_definition(node)
-            if func_info:
-                functions.append(func_info)
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return functions
-
-def _parse_function_definition(node):
+def _query_matches(query, node):
+    """Run a compiled query on a node, across py-tree-sitter versions"""
+    if QueryCursor is not None:
+        return QueryCursor(query).matches(node)
+    return query.matches(node)
+
+def _node_text(source_bytes, node):
+    """Decode a node's text from the shared source buffer (bytes input may be invalid UTF-8)"""
+    return source_bytes[node.start_byte:node.end_byte].decode('utf8', 'replace')
+
+def _node_name(source_bytes, node):
+    """Decode an identifier or type name, interned: names repeat across records"""
+    return sys.intern(_node_text(source_bytes, node))
+
+def _measure_tree(root_node, max_depth=AST_MAX_DEPTH):
+    """Count AST nodes (not expanded below max_depth) and compute the maximum depth
+
+    Only moves a TreeCursor, so no Python node objects are created.
+    """
+    cursor = root_node.walk()
+    node_count = 1
+    depth = max_seen_depth = 0
+    while True:
+        if cursor.goto_first_child():
+            depth += 1
+            if depth > max_seen_depth:
+                max_seen_depth = depth
+        else:
+            while not cursor.goto_next_sibling():
+                if not cursor.goto_parent():
+                    return node_count, max_seen_depth
+                depth -= 1
+        if depth <= max_depth + 1:
+            node_count += 1
+
+def _match_patterns(root_node, source_bytes):
+    """Collect pattern records for every node matched by PATTERN_QUERY"""
+    patterns = {
+        'functions': [],
+        'calls': [],
+        'variables': [],
+        'pointers': [],
+        'arrays': [],
+        'conditions': [],
+        'loops': []
+    }
+
+    matched = {}
+    for _, captures in _query_matches(PATTERN_QUERY, root_node):
+        for capture_name, nodes in captures.items():
+            matched.setdefault(capture_name, []).extend(nodes)
+
+    for capture_name, nodes in matched.items():
+        # Document pre-order: outer nodes before nested ones starting at the same byte
+        nodes.sort(key=lambda node: (node.start_byte, -node.end_byte))
+        handler = PATTERN_HANDLERS[capture_name]
+        for node in nodes:
+            handler(node, patterns, source_bytes)
+
+    return patterns
+
+def _on_function_definition(node, patterns, source_bytes):
+    """Record a function definition"""
+    func_info = _parse_function_definition(node, source_bytes)
+    if func_info:
+        patterns['functions'].append(func_info)
+
+def _on_call_expression(node, patterns, source_bytes):
+    """Record a function call"""
+    call_info = _parse_function_call(node, source_bytes)
+    if call_info:
+        patterns['calls'].append(call_info)
+
+def _on_declaration(node, patterns, source_bytes):
+    """Record the variables of a declaration"""
+    var_info = _parse_variable_declaration(node, source_bytes)
+    if var_info:
+        patterns['variables'].extend(var_info)
+
+def _on_pointer_operation(node, patterns, source_bytes):
+    """Record a pointer dereference or field access"""
+    patterns['pointers'].append({
+        'operation': truncate_utf8(source_bytes, 50, node.start_byte, node.end_byte),  # Limit length
+        'type': node.type,
+        'line': node.start_point[0] + 1
+    })
+
+def _on_array_operation(node, patterns, source_bytes):
+    """Record an array subscript"""
+    patterns['arrays'].append({
+        'operation': truncate_utf8(source_bytes, 50, node.start_byte, node.end_byte),
+        'line': node.start_point[0] + 1
+    })
+
+def _on_conditional(node, patterns, source_bytes):
+    """Record a conditional statement"""
+    patterns['conditions'].append({
+        'type': node.type,
+        'line': node.start_point[0] + 1
+    })
+
+def _on_loop(node, patterns, source_bytes):
+    """Record a loop statement"""
+    patterns['loops'].append({
+        'type': node.type,
+        'line': node.start_point[0] + 1
+    })
+
+# Pattern handlers by PATTERN_QUERY capture name
+PATTERN_HANDLERS = {
+    'function': _on_function_definition,
+    'call': _on_call_expression,
+    'variable': _on_declaration,
+    'pointer': _on_pointer_operation,
+    'array': _on_array_operation,
+    'condition': _on_conditional,
+    'loop': _on_loop
+}
+
+def _parse_function_definition(node, source_bytes):
     """Parse function definition node"""
-    try:
-        func_name = None
-        return_type = None
-        params = []
-
-        # Find function declarator
-        for child in node.children:
-            if child.type == 'function_declarator':
-                # Get function name
-                for grandchild in child.children:
-                    if grandchild.type == 'identifier':
-                        func_name = grandchild.text.decode('utf8')
-                    elif grandchild.type == 'parameter_list':
-                        # Extract parameters
-                        for param in grandchild.children:
-                            if param.type == 'parameter_declaration':
-                                param_text = param.text.decode('utf8')
-                                params.append(param_text.strip())
-
-            # Try to get return type (simplified)
-            elif child.type in ['primitive_type', 'type_identifier']:
-                return_type = child.text.decode('utf8')
-
-        if func_name:
-            return {
-                'name': func_name,
-                'return_type': return_type or 'unknown',
-                'params': params,
-                'line': node.start_point[0] + 1
-            }
-    except Exception:
-        pass
+    func_name = None
+    return_type = None
+    params = []
+
+    # Find function declarator (under any pointer declarators of the return type)
+    declarator = node.child_by_field_name('declarator')
+    while declarator is not None and declarator.kind_id != FUNCTION_DECLARATOR_KIND:
+        declarator = declarator.child_by_field_name('declarator')
+
+    if declarator is not None:
+        # Get function name
+        name_node = declarator.child_by_field_name('declarator')
+        if name_node is not None and name_node.kind_id == IDENTIFIER_KIND:
+            func_name = _node_name(source_bytes, name_node)
+
+        # Extract parameters
+        param_list = declarator.child_by_field_name('parameters')
+        if param_list is not None:
+            for param in param_list.named_children:
+                if param.kind_id == PARAMETER_DECLARATION_KIND:
+                    param_text = _node_text(source_bytes, param)
+                    params.append(param_text.strip())
+
+    # Try to get return type (simplified)
+    type_node = node.child_by_field_name('type')
+    if type_node is not None and type_node.kind_id in TYPE_NAME_KINDS:
+        return_type = _node_name(source_bytes, type_node)
+
+    if func_name:
+        return {
+            'name': func_name,
+            'return_type': return_type or 'unknown',
+            'params': params,
+            'line': node.start_point[0] + 1
+        }
 
     return None
 
-def _extract_function_calls(root_node):
-    """Extract function calls from AST"""
-    calls = []
-
-    def traverse(node):
-        if node.type == 'call_expression':
-            call_info = _parse_function_call(node)
-            if call_info:
-                calls.append(call_info)
+def _parse_function_call(node, source_bytes):
+    """Parse function call node"""
+    func_name = None
+    args = []
 
-        for child in node.children:
-            traverse(child)
+    function = node.child_by_field_name('function')
+    if function is not None and function.kind_id == IDENTIFIER_KIND:
+        func_name = _node_name(source_bytes, function)
 
-    traverse(root_node)
-    return calls
+    arguments = node.child_by_field_name('arguments')
+    if arguments is not None:
+        # Count arguments
+        for arg in arguments.children:
+            if arg.kind_id not in ARGUMENT_PUNCTUATION_KINDS:
+                args.append(_node_text(source_bytes, arg))
 
-def _parse_function_call(node):
-    """Parse function call node"""
-    try:
-        func_name = None
-        args = []
-
-        for child in node.children:
-            if child.type == 'identifier':
-                func_name = child.text.decode('utf8')
-            elif child.type == 'argument_list':
-                # Count arguments
-                for arg in child.children:
-                    if arg.type not in {',', '(', ')'}:
-                        args.append(arg.text.decode('utf8'))
-
-        if func_name:
-            return {
-                'function': func_name,
-                'args': args,
-                'line': node.start_point[0] + 1
-            }
-    except Exception:
-        pass
+    if func_name:
+        return {
+            'function': func_name,
+            'args': args,
+            'line': node.start_point[0] + 1
+        }
 
     return None
 
-def _extract_variables(root_node):
-    """Extract variable declarations from AST"""
+def _parse_variable_declaration(node, source_bytes):
+    """Parse variable declaration node"""
     variables = []
+    var_type = None
 
-    def traverse(node):
-        if node.type in ['declaration', 'parameter_declaration']:
-            var_info = _parse_variable_declaration(node)
+    # Get type information
+    for child in node.children:
+        if child.kind_id in TYPE_NAME_KINDS:
+            var_type = _node_name(source_bytes, child)
+        elif child.kind_id in DECLARATOR_KINDS:
+            var_info = _extract_declarator_info(child, var_type, source_bytes)
             if var_info:
-                variables.extend(var_info)
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return variables
-
-def _parse_variable_declaration(node):
-    """Parse variable declaration node"""
-    variables = []
-    try:
-        var_type = None
-
-        # Get type information
-        for child in node.children:
-            if child.type in ['primitive_type', 'type_identifier']:
-                var_type = child.text.decode('utf8')
-            elif child.type in ['init_declarator', 'declarator', 'pointer_declarator', 'array_declarator']:
-                var_info = _extract_declarator_info(child, var_type)
-                if var_info:
-                    var_info['line'] = node.start_point[0] + 1
-                    variables.append(var_info)
-    except Exception:
-        pass
+                var_info['line'] = node.start_point[0] + 1
+                variables.append(var_info)
 
     return variables
 
-def _extract_declarator_info(node, var_type):
+def _extract_declarator_info(node, var_type, source_bytes):
     """Extract variable info from declarator"""
-    try:
-        for child in node.children:
-            if child.type == 'identifier':
-                return {
-                    'name': child.text.decode('utf8'),
-                    'type': var_type or 'unknown',
-                    'is_pointer': node.type == 'pointer_declarator',
-                    'is_array': node.type == 'array_declarator'
-                }
-            elif child.type in ['pointer_declarator', 'array_declarator', 'declarator']:
-                # Recursive extraction for nested declarators
-                return _extract_declarator_info(child, var_type)
-    except Exception:
-        pass
-
-    return None
-
-def _extract_pointer_operations(root_node):
-    """Extract pointer operations from AST"""
-    pointers = []
-
-    def traverse(node):
-        if node.type in ['pointer_expression', 'field_expression']:
-            pointers.append({
-                'operation': node.text.decode('utf8')[:50],  # Limit length
-                'type': node.type,
-                'line': node.start_point[0] + 1
-            })
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return pointers
-
-def _extract_array_operations(root_node):
-    """Extract array operations from AST"""
-    arrays = []
-
-    def traverse(node):
-        if node.type == 'subscript_expression':
-            arrays.append({
-                'operation': node.text.decode('utf8')[:50],
-                'line': node.start_point[0] + 1
-            })
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return arrays
-
-def _extract_conditionals(root_node):
-    """Extract conditional statements from AST"""
-    conditionals = []
-
-    def traverse(node):
-        if node.type in ['if_statement', 'conditional_expression', 'switch_statement']:
-            conditionals.append({
-                'type': node.type,
-                'line': node.start_point[0] + 1
-            })
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return conditionals
-
-def _extract_loops(root_node):
-    """Extract loop statements from AST"""
-    loops = []
-
-    def traverse(node):
-        if node.type in ['for_statement', 'while_statement', 'do_statement']:
-            loops.append({
-                'type': node.type,
-                'line': node.start_point[0] + 1
-            })
-
-        for child in node.children:
-            traverse(child)
-
-    traverse(root_node)
-    return loops
+    # Walk inward through pointer/array wrappers, keeping what each level adds
+    is_pointer = is_array = False
+    while True:
+        is_pointer = is_pointer or node.kind_id == POINTER_DECLARATOR_KIND
+        is_array = is_array or node.kind_id == ARRAY_DECLARATOR_KIND
+        child = node.child_by_field_name('declarator')
+        if child is None:
+            return None
+        if child.kind_id == IDENTIFIER_KIND:
+            return {
+                'name': _node_name(source_bytes, child),
+                'type': var_type or 'unknown',
+                'is_pointer': is_pointer,
+                'is_array': is_array
+            }
+        if child.kind_id not in NESTED_DECLARATOR_KINDS:
+            return None
+        node = child
 
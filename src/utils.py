@@ -4,17 +4,68 @@ Common utilities for the Vulnerability Knowledge Base project
 Centralizes repeated functions and common patterns
 """
 
+import functools
+import hashlib
+import os
+import queue
 import threading
 import time
-from typing import Dict, Any, Callable, List
+from collections import OrderedDict
+from concurrent.futures import Future, TimeoutError as FuturesTimeoutError
+from typing import Dict, Any, Callable, List, Union
 from pathlib import Path
-import json
+import orjson
 import re
 
+# Configuration imports with fallback
+try:
+    from .config import ENRICHED_FILE_PATTERNS
+except ImportError:
+    from config import ENRICHED_FILE_PATTERNS
+
+# Precompiled CWE patterns (matched case-insensitively)
+_CWE_RE = re.compile(r'CWE-\d+', re.IGNORECASE)
+_CWE_VALIDATE_RE = re.compile(r'^CWE-\d+$', re.IGNORECASE)
+
+# Reusable daemon worker threads for timeout_wrapper. A worker is reserved
+# per submitted call and a new one is only started when none is idle, so
+# calls that time out (and keep running) never delay later calls.
+_WORK_QUEUE = queue.SimpleQueue()
+_WORKER_LOCK = threading.Lock()
+_idle_workers = 0
+
+def _worker_loop():
+    """Run submitted calls forever, going back to the idle count after each one"""
+    global _idle_workers
+    while True:
+        future, func, args = _WORK_QUEUE.get()
+        if future.set_running_or_notify_cancel():
+            try:
+                future.set_result(func(*args))
+            except BaseException as e:
+                future.set_exception(e)
+        with _WORKER_LOCK:
+            _idle_workers += 1
+
+def _submit(func: Callable, args: tuple) -> Future:
+    """Queue a call for a reserved worker thread, starting one if none is idle"""
+    global _idle_workers
+    future = Future()
+    with _WORKER_LOCK:
+        if _idle_workers:
+            _idle_workers -= 1
+        else:
+            threading.Thread(target=_worker_loop, daemon=True).start()
+    _WORK_QUEUE.put((future, func, args))
+    return future
+
 def timeout_wrapper(func: Callable, args: tuple, timeout_seconds: int) -> Dict[str, Any]:
     """
     Generic wrapper to execute a function with timeout
     
+    The function runs on a pooled daemon thread. A timed-out call cannot be
+    interrupted and finishes in the background; its result is discarded.
+    
     Args:
         func: Function to execute
         args: Function arguments
@@ -23,26 +74,60 @@ def timeout_wrapper(func: Callable, args: tuple, timeout_seconds: int) -> Dict[s
     Returns:
         Function result or error dictionary
     """
-    result = [None]
-    exception = [None]
-    
-    def target():
-        try:
-            result[0] = func(*args)
-        except Exception as e:
-            exception[0] = e
+    future = _submit(func, args)
+    try:
+        return future.result(timeout_seconds)
+    except FuturesTimeoutError:
+        return {'success': False, 'error': 'timeout'}
+    except Exception as e:
+        return {'success': False, 'error': str(e)}
+
+def memoize_by_source_hash(maxsize: int, max_source_bytes: int) -> Callable:
+    """
+    Decorator caching successful extraction results by source digest
     
-    thread = threading.Thread(target=target)
-    thread.daemon = True
-    thread.start()
-    thread.join(timeout_seconds)
+    The decorated function takes the source code (str or UTF-8 bytes) as
+    its first argument. Results are keyed on a BLAKE2b digest of the UTF-8
+    source (plus the remaining arguments) in a bounded LRU. Only results
+    with success=True are cached, so timeouts and errors are retried.
+    Sources larger than max_source_bytes bypass the cache. Cached dictionaries are shared
+    between callers and must not be mutated.
     
-    if thread.is_alive():
-        return {'success': False, 'error': 'timeout'}
-    elif exception[0]:
-        return {'success': False, 'error': str(exception[0])}
-    else:
-        return result[0]
+    Args:
+        maxsize: Maximum number of cached results
+        max_source_bytes: Size above which sources are not cached
+        
+    Returns:
+        Decorator
+    """
+    def decorator(func: Callable) -> Callable:
+        cache = OrderedDict()
+        lock = threading.Lock()
+        
+        @functools.wraps(func)
+        def wrapper(source: Union[str, bytes], *args, **kwargs):
+            source_bytes = source if isinstance(source, bytes) else source.encode('utf8')
+            if len(source_bytes) > max_source_bytes:
+                return func(source, *args, **kwargs)
+            
+            digest = hashlib.blake2b(source_bytes, digest_size=16).digest()
+            key = (digest, args, tuple(sorted(kwargs.items())))
+            with lock:
+                if key in cache:
+                    cache.move_to_end(key)
+                    return cache[key]
+            
+            result = func(source, *args, **kwargs)
+            if isinstance(result, dict) and result.get('success'):
+                with lock:
+                    cache[key] = result
+                    if len(cache) > maxsize:
+                        cache.popitem(last=False)
+            return result
+        
+        wrapper.cache_clear = cache.clear
+        return wrapper
+    return decorator
 
 def safe_json_load(file_path: Path) -> Dict[str, Any]:
     """
@@ -55,37 +140,67 @@ def safe_json_load(file_path: Path) -> Dict[str, Any]:
         JSON data or error dictionary
     """
     try:
-        with open(file_path, 'r', encoding='utf-8') as f:
-            return json.load(f)
+        with open(file_path, 'rb') as f:
+            return orjson.loads(f.read())
     except FileNotFoundError:
         return {'success': False, 'error': f'File not found: {file_path}'}
-    except json.JSONDecodeError as e:
+    except orjson.JSONDecodeError as e:
         return {'success': False, 'error': f'JSON error: {str(e)}'}
     except Exception as e:
         return {'success': False, 'error': f'Unexpected error: {str(e)}'}
 
-def safe_json_save(data: Dict[str, Any], file_path: Path) -> bool:
+def safe_json_save(data: Dict[str, Any], file_path: Path, pretty: bool = True) -> bool:
     """
     Save JSON data securely
     
+    The data is written to a temporary file next to the destination, which
+    then replaces it atomically, so readers never see a partial file.
+    
     Args:
         data: Data to save
         file_path: Destination path
+        pretty: Indent the output (2 spaces); compact when False
         
     Returns:
         True if successful, False otherwise
     """
+    tmp_path = file_path.with_suffix(file_path.suffix + '.tmp')
     try:
         # Create parent directory if necessary
         file_path.parent.mkdir(parents=True, exist_ok=True)
         
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+        option = orjson.OPT_NON_STR_KEYS
+        if pretty:
+            option |= orjson.OPT_INDENT_2
+        with open(tmp_path, 'wb') as f:
+            f.write(orjson.dumps(data, option=option))
+        os.replace(tmp_path, file_path)
         return True
     except Exception as e:
         print(f"Error saving {file_path}: {e}")
+        tmp_path.unlink(missing_ok=True)
         return False
 
+def list_enriched_files(directory: Path) -> List[Path]:
+    """
+    List the hybrid KB files of a directory, one per CWE
+    
+    When a legacy hybrid_kb_<CWE>.json sits next to the JSONL KB of the same
+    CWE, only the .jsonl file is returned, so entries are not counted twice.
+    
+    Args:
+        directory: Directory holding the enriched KBs
+        
+    Returns:
+        Sorted list of KB paths
+    """
+    files = {}
+    for pattern in ENRICHED_FILE_PATTERNS:
+        for path in directory.glob(pattern):
+            if path.suffix == '.jsonl' or path.stem not in files:
+                files[path.stem] = path
+    return sorted(files.values())
+
 def extract_cwe_from_filename(filename: str) -> str:
     """
     Extract CWE from filename robustly
@@ -96,16 +211,9 @@ def extract_cwe_from_filename(filename: str) -> str:
     Returns:
         Extracted CWE or filename without extension
     """
-    # Valid CWE patterns
-    cwe_patterns = [
-        r'CWE-\d+',
-        r'cwe-\d+',
-    ]
-    
-    for pattern in cwe_patterns:
-        match = re.search(pattern, filename, re.IGNORECASE)
-        if match:
-            return match.group().upper()
+    match = _CWE_RE.search(filename)
+    if match:
+        return match.group().upper()
     
     # Fallback: use filename without extension
     return Path(filename).stem
@@ -120,7 +228,7 @@ def validate_cwe_format(cwe: str) -> bool:
     Returns:
         True if valid format, False otherwise
     """
-    return bool(re.match(r'^CWE-\d+$', cwe, re.IGNORECASE))
+    return bool(_CWE_VALIDATE_RE.match(cwe))
 
 def safe_function_call(func: Callable, *args, **kwargs) -> Dict[str, Any]:
     """
@@ -193,12 +301,33 @@ def clean_error_message(error: str, max_length: int = 100) -> str:
     if not error:
         return "Unknown error"
     
-    # Clean problematic characters
-    cleaned = str(error).strip()
-    cleaned = re.sub(r'\s+', ' ', cleaned)  # Normalize spaces
+    # Clean problematic characters: split() drops leading/trailing whitespace
+    # and collapses every inner run to one space
+    cleaned = ' '.join(str(error).split())
     
     # Truncate if necessary
     if len(cleaned) > max_length:
         cleaned = cleaned[:max_length-3] + "..."
     
-    return cleaned 
\ No newline at end of file
+    return cleaned 
+
+def truncate_utf8(data: bytes, max_chars: int, start: int = 0, end: int = None) -> str:
+    """
+    Decode at most max_chars characters from UTF-8 bytes
+    
+    Only the byte prefix that can hold max_chars characters (4 bytes each
+    at most) is decoded, so long source spans are never decoded in full.
+    
+    Args:
+        data: UTF-8 encoded bytes
+        max_chars: Maximum number of characters
+        start: Start offset of the span within data
+        end: End offset of the span within data (default: end of data)
+        
+    Returns:
+        Decoded and truncated text
+    """
+    stop = start + max_chars * 4
+    if end is not None and end < stop:
+        stop = end
+    return data[start:stop].decode('utf8', 'ignore')[:max_chars]
@@ -0,0 +1,51 @@
+"""
+Tests for the PDG builder
+"""
+
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from build_pdg import build_simple_pdg
+
+
+def _function_pdg(code, name):
+    result = build_simple_pdg(code)
+    assert result['success']
+    return result['functions'][name]
+
+
+def test_kernel_allocator_patterns_match_baseline_counts():
+    code = '''int setup(struct ctx *ctx, size_t len)
+{
+    char *buf = kmalloc(len, GFP_KERNEL);
+    if (!buf)
+        return -ENOMEM;
+    ctx->data = (u8 *)buf;
+    memcpy(buf, ctx->src, len);
+    kfree(ctx->old);
+    vfree(ctx->table);
+    return 0;
+}
+'''
+    patterns = _function_pdg(code, 'setup')['patterns']
+    assert {kind: len(ops) for kind, ops in patterns.items()} == {
+        'buffer_operations': 2,
+        'pointer_operations': 9,
+        'memory_operations': 6,
+        'function_calls': 4,
+    }
+
+
+def test_pointer_cast_counts_as_pointer_operation():
+    code = 'void f(void *x)\n{\n    long v;\n    v = (long)(char *)x;\n}\n'
+    lines = {op['line'] for op in _function_pdg(code, 'f')['patterns']['pointer_operations']}
+    assert 4 in lines
+
+
+def test_pointer_initialization_defines_inner_name():
+    code = 'int f(int *q)\n{\n    int *p = q;\n    return *p;\n}\n'
+    pdg = _function_pdg(code, 'f')
+    assert pdg['statements'][0]['variables_defined'] == ['p']
+    assert any(dep['variable'] == 'p' for dep in pdg['dependencies'])